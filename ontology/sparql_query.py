@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Run SPARQL query files against the CLLM ontology.
+
+The TTL sources (cllm.ttl plus the framework ontologies linked by
+setup_symlinks.py) are parsed once into a pickled graph store under
+.cache/. The store is rebuilt only when a source file's mtime or size
+changes, and query results are cached against the same fingerprint, so
+repeated queries are answered without touching the Turtle parser.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import pickle
+import shutil
+import sys
+from functools import lru_cache
+from pathlib import Path
+
+from setup_symlinks import FRAMEWORK_ONTOLOGIES
+
+logger = logging.getLogger(__name__)
+
+ONTOLOGY_DIR = Path(__file__).resolve().parent
+DEFAULT_SOURCES = ['cllm.ttl'] + list(FRAMEWORK_ONTOLOGIES)
+CACHE_DIR = ONTOLOGY_DIR / '.cache'
+STORE_FILE = 'store.pickle'
+RESULTS_DIR = 'results'
+
+# Line separating queries in multi-query files such as
+# analyze_framework_usage.sparql
+QUERY_SEPARATOR = '---'
+
+
+def source_fingerprint(sources):
+    """Return a stable fingerprint of the readable sources' mtimes/sizes."""
+    entries = []
+    for source in sources:
+        try:
+            stat = Path(source).stat()
+        except OSError:
+            # Dangling framework symlinks are expected when the
+            # ontology-framework submodule is not checked out
+            continue
+        entries.append(
+            (str(Path(source).resolve()), stat.st_mtime_ns, stat.st_size)
+        )
+    digest = hashlib.sha256(json.dumps(entries).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class OntologyStore:
+    """Persistent, fingerprinted graph store with a query result cache."""
+
+    def __init__(self, sources, cache_dir=CACHE_DIR, use_cache=True):
+        self.sources = [Path(source) for source in sources]
+        self.cache_dir = Path(cache_dir)
+        self.use_cache = use_cache
+        self.fingerprint = source_fingerprint(self.sources)
+        self._graph = None
+
+    @property
+    def base(self):
+        """Base IRI for resolving relative prefixes such as <./meta#>."""
+        return ONTOLOGY_DIR.as_uri() + '/'
+
+    @property
+    def graph(self):
+        """Load the graph lazily; result cache hits never need it."""
+        if self._graph is None:
+            self._graph = self._load()
+        return self._graph
+
+    def _load(self):
+        store_path = self.cache_dir / STORE_FILE
+        if self.use_cache and store_path.exists():
+            try:
+                with open(store_path, 'rb') as f:
+                    fingerprint, graph = pickle.load(f)
+                if fingerprint == self.fingerprint:
+                    logger.debug("Loaded graph store from %s", store_path)
+                    return graph
+            except (OSError, pickle.PickleError, EOFError, AttributeError,
+                    ImportError, ValueError) as e:
+                # Stale pickles from another rdflib version are rebuilt
+                logger.warning(f"Ignoring unreadable store {store_path}: {e}")
+
+        # Deferred so result cache hits skip the cost of importing rdflib
+        from rdflib import Graph
+
+        graph = Graph()
+        for source in self.sources:
+            if not source.exists():
+                logger.warning(f"Skipping missing ontology: {source}")
+                continue
+            logger.info(f"Parsing {source}")
+            graph.parse(source, format='turtle')
+
+        if self.use_cache:
+            self.cache_dir.mkdir(exist_ok=True)
+            tmp_path = store_path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((self.fingerprint, graph), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(store_path)
+            logger.info(f"Rebuilt graph store: {store_path}")
+        return graph
+
+    def _result_path(self, query_text):
+        key = hashlib.sha256(query_text.encode('utf-8')).hexdigest()
+        return self.cache_dir / RESULTS_DIR / self.fingerprint / f"{key}.json"
+
+    def _prune_results(self):
+        """Delete results cached for any other fingerprint of the sources."""
+        results_dir = self.cache_dir / RESULTS_DIR
+        if not results_dir.exists():
+            return
+        for entry in results_dir.iterdir():
+            if entry.name == self.fingerprint:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
+            logger.debug("Pruned stale results: %s", entry)
+
+    def query(self, query_text):
+        """Run a query and return (variables, rows) of plain strings."""
+        result_path = self._result_path(query_text)
+        if self.use_cache and result_path.exists():
+            with open(result_path) as f:
+                cached = json.load(f)
+            return cached['vars'], cached['rows']
+
+        result = self.graph.query(prepared_query(query_text, self.base))
+        variables = [str(var) for var in result.vars or []]
+        rows = [
+            [None if value is None else str(value) for value in row]
+            for row in result
+        ]
+
+        if self.use_cache:
+            if not result_path.parent.exists():
+                # First result for these sources: older ones are stale
+                self._prune_results()
+                result_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(result_path, 'w') as f:
+                json.dump({'vars': variables, 'rows': rows}, f)
+        return variables, rows
+
+
+@lru_cache(maxsize=None)
+def prepared_query(query_text, base):
+    """Parse and algebra-translate a query once per process."""
+    from rdflib.plugins.sparql import prepareQuery
+
+    return prepareQuery(query_text, base=base)
+
+
+def split_queries(text):
+    """Split a .sparql file on '---' lines, sharing the leading prologue."""
+    parts = []
+    current = []
+    for line in text.splitlines():
+        if line.strip() == QUERY_SEPARATOR:
+            parts.append('\n'.join(current))
+            current = []
+        else:
+            current.append(line)
+    parts.append('\n'.join(current))
+    parts = [part for part in parts if part.strip()]
+    if not parts:
+        return []
+
+    prologue = '\n'.join(
+        line for line in parts[0].splitlines()
+        if line.strip().upper().startswith(('PREFIX', 'BASE'))
+    )
+    return [parts[0]] + [prologue + '\n' + part for part in parts[1:]]
+
+
+def write_results(variables, rows, output_format, out=sys.stdout):
+    """Write one query's results as TSV or JSON."""
+    if output_format == 'json':
+        json.dump(
+            [dict(zip(variables, row)) for row in rows], out, indent=2
+        )
+        out.write('\n')
+        return
+
+    writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+    writer.writerow(variables)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+
+
+def main():
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(
+        description="Run .sparql files against the CLLM ontology"
+    )
+    parser.add_argument('queries', nargs='+', type=Path,
+                        help='SPARQL query files to run')
+    parser.add_argument('--format', choices=['tsv', 'json'], default='tsv',
+                        help='Output format (default: tsv)')
+    parser.add_argument('--ttl', action='append', type=Path,
+                        help='TTL source to load (repeatable; default: '
+                             'cllm.ttl and the framework ontologies)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Parse sources and run queries without the '
+                             'persistent store or result cache')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Log store rebuilds and cache activity')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format='%(levelname)s: %(message)s',
+        force=True,
+    )
+
+    sources = args.ttl or [ONTOLOGY_DIR / name for name in DEFAULT_SOURCES]
+    store = OntologyStore(sources, use_cache=not args.no_cache)
+
+    results = {}
+    failed = []
+    for query_file in args.queries:
+        queries = split_queries(query_file.read_text())
+        for index, query_text in enumerate(queries):
+            label = query_file.name
+            if len(queries) > 1:
+                label += f" [{index + 1}]"
+            try:
+                results[label] = store.query(query_text)
+            except Exception as e:
+                logger.error(f"Query {label} failed: {e}")
+                failed.append(label)
+
+    if args.format == 'json' and len(results) > 1:
+        json.dump({
+            label: [dict(zip(variables, row)) for row in rows]
+            for label, (variables, rows) in results.items()
+        }, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        for label, (variables, rows) in results.items():
+            if len(results) > 1:
+                print(f"# {label}")
+            write_results(variables, rows, args.format)
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
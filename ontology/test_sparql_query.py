@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Test suite for the cached SPARQL runner."""
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import sparql_query
+from sparql_query import OntologyStore, split_queries
+
+
+QUERY = """
+    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+    SELECT ?s ?label WHERE { ?s rdfs:label ?label } ORDER BY ?label
+"""
+
+
+class TestOntologyStore(unittest.TestCase):
+    """Test cases for the persistent store and result cache."""
+
+    def setUp(self):
+        """Set up a temporary ontology and cache directory."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.ttl = Path(self.tmp.name) / "test.ttl"
+        self.cache = Path(self.tmp.name) / "cache"
+        self.write_ttl('"first"')
+
+    def write_ttl(self, label):
+        """Write a one-triple ontology with the given label."""
+        self.ttl.write_text(f"""
+            @prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+            @prefix : <http://example.org/> .
+            :Thing rdfs:label {label} .
+        """)
+
+    def test_query_results(self):
+        """Test that a query returns variables and string rows."""
+        store = OntologyStore([self.ttl], cache_dir=self.cache)
+        variables, rows = store.query(QUERY)
+        self.assertEqual(variables, ["s", "label"])
+        self.assertEqual(rows, [["http://example.org/Thing", "first"]])
+
+    def test_result_cache_skips_graph(self):
+        """Test that a repeated query does not load the graph."""
+        OntologyStore([self.ttl], cache_dir=self.cache).query(QUERY)
+        store = OntologyStore([self.ttl], cache_dir=self.cache)
+        with mock.patch.object(OntologyStore, "_load") as load:
+            store.query(QUERY)
+        load.assert_not_called()
+
+    def test_rebuild_on_source_change(self):
+        """Test that a changed source invalidates store and results."""
+        OntologyStore([self.ttl], cache_dir=self.cache).query(QUERY)
+        self.write_ttl('"second"')
+        later = time.time() + 10
+        os.utime(self.ttl, (later, later))
+        store = OntologyStore([self.ttl], cache_dir=self.cache)
+        _, rows = store.query(QUERY)
+        self.assertEqual(rows[0][1], "second")
+
+    def test_stale_results_pruned(self):
+        """Test that results for an older version of the sources go away."""
+        OntologyStore([self.ttl], cache_dir=self.cache).query(QUERY)
+        self.write_ttl('"second"')
+        later = time.time() + 10
+        os.utime(self.ttl, (later, later))
+        store = OntologyStore([self.ttl], cache_dir=self.cache)
+        store.query(QUERY)
+        results = list((self.cache / "results").iterdir())
+        self.assertEqual([entry.name for entry in results],
+                         [store.fingerprint])
+        self.assertEqual(len(list(results[0].iterdir())), 1)
+
+    def test_missing_source_skipped(self):
+        """Test that dangling framework symlinks do not break loading."""
+        missing = Path(self.tmp.name) / "missing.ttl"
+        store = OntologyStore([self.ttl, missing], cache_dir=self.cache)
+        _, rows = store.query(QUERY)
+        self.assertEqual(len(rows), 1)
+
+    def test_failed_query_exits_nonzero(self):
+        """Test that the CLI reports a failing query in its exit status."""
+        good = Path(self.tmp.name) / "good.sparql"
+        good.write_text(QUERY)
+        bad = Path(self.tmp.name) / "bad.sparql"
+        bad.write_text("SELECT ?s WHERE { ?s")
+        argv = ["sparql_query.py", "--no-cache", "--ttl", str(self.ttl),
+                str(good), str(bad)]
+        with mock.patch("sys.argv", argv), \
+                mock.patch.object(sparql_query, "write_results") as write:
+            with self.assertRaises(SystemExit) as raised:
+                sparql_query.main()
+        self.assertEqual(raised.exception.code, 1)
+        write.assert_called_once()
+
+
+class TestSplitQueries(unittest.TestCase):
+    """Test cases for multi-query files."""
+
+    def test_prologue_shared(self):
+        """Test that later queries inherit the first query's prefixes."""
+        text = (
+            "PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>\n"
+            "SELECT ?a WHERE { ?a rdfs:label ?b }\n"
+            "---\n"
+            "SELECT ?b WHERE { ?a rdfs:label ?b }\n"
+        )
+        queries = split_queries(text)
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(queries[1].startswith("PREFIX rdfs:"))
+
+
+if __name__ == '__main__':
+    unittest.main()
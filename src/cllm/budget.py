@@ -0,0 +1,170 @@
+# cllm budget governor: live --budget-tokens / --budget-usd limits with pre-send estimates
+
+# (c) Copyright Matthew Wallace 2024; Licensed under Apache-2.0 Text version: https://www.apache.org/licenses/LICENSE-2.0.txt (see LICENSE)
+
+import sys
+import threading
+from typing import Callable, NamedTuple, Optional
+
+from cllm.models import UNLIMITED_OUTPUT_RESERVE, ModelPrice, lookup_price
+
+BUDGET_POLICIES = ('stop', 'cheaper-model', 'lower-limit')
+DEFAULT_MIN_LIMIT = 64
+# Exit status of a run stopped by the budget, so scripts can tell it from success and errors
+EXIT_BUDGET_EXHAUSTED = 3
+
+
+class BudgetExhausted(Exception):
+    """The next call cannot fit in what is left of the budget under the configured policy."""
+
+
+class Reservation(NamedTuple):
+    """Worst-case spend held for one call in flight; model and limit may differ from what was asked for."""
+    model: str
+    limit: Optional[int]
+    tokens: int
+    usd: float
+
+
+class Budget:
+    """Enforce token and/or USD limits across concurrent calls.
+
+    Before a call is sent, its worst case is reserved: estimated input tokens plus
+    the full output limit. After the call, the reservation is replaced by the
+    actual usage. A call is only sent if its worst case fits next to everything
+    spent and reserved, so the limits hold however many calls are in flight. When
+    a call does not fit, the governor waits for in-flight calls to settle (they
+    usually cost less than reserved) before applying the policy:
+
+    stop           raise BudgetExhausted
+    cheaper-model  switch to fallback_model for the rest of the run, if that fits
+    lower-limit    shrink the output limit to what is affordable, down to min_limit
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, max_usd: Optional[float] = None, policy: str = 'stop', fallback_model: Optional[str] = None,
+                 min_limit: int = DEFAULT_MIN_LIMIT, overhead_tokens: int = 0, input_factor: float = 1.0,
+                 price_for: Callable[[str], Optional[ModelPrice]] = lookup_price):
+        self.max_tokens = max_tokens
+        self.max_usd = max_usd
+        self.policy = policy
+        self.fallback_model = fallback_model
+        self.min_limit = min_limit
+        self.overhead_tokens = overhead_tokens  # system prompt and chat framing, not in the counted prompt
+        self.input_factor = input_factor  # > 1 when counting with an approximate tokenizer
+        self.price_for = price_for
+        self.condition = threading.Condition()
+        self.spent_tokens = 0
+        self.spent_usd = 0.0
+        self.reserved_tokens = 0
+        self.reserved_usd = 0.0
+        self.in_flight = 0
+        self.switched = False
+        self.lowered_calls = 0
+        self.exhausted: Optional[str] = None
+
+    def _cost(self, model: str, input_tokens: int, output_tokens: int) -> float:
+        if self.max_usd is None:
+            return 0.0
+        price = self.price_for(model)
+        return (input_tokens * price.input + output_tokens * price.output) / 1e6
+
+    def _estimate_input(self, input_tokens: int) -> int:
+        return int(input_tokens * self.input_factor) + self.overhead_tokens
+
+    def _fits(self, tokens: int, usd: float) -> bool:
+        if self.max_tokens is not None and self.spent_tokens + self.reserved_tokens + tokens > self.max_tokens:
+            return False
+        if self.max_usd is not None and self.spent_usd + self.reserved_usd + usd > self.max_usd:
+            return False
+        return True
+
+    def _affordable_output(self, model: str, input_tokens: int) -> int:
+        """Most output tokens a call could be allowed next to what is spent and reserved."""
+        affordable = None
+        if self.max_tokens is not None:
+            affordable = self.max_tokens - self.spent_tokens - self.reserved_tokens - input_tokens
+        if self.max_usd is not None:
+            price = self.price_for(model)
+            left_usd = self.max_usd - self.spent_usd - self.reserved_usd - self._cost(model, input_tokens, 0)
+            by_usd = int(left_usd * 1e6 / price.output) if price.output else UNLIMITED_OUTPUT_RESERVE
+            affordable = by_usd if affordable is None else min(affordable, by_usd)
+        return affordable if affordable is not None else UNLIMITED_OUTPUT_RESERVE
+
+    def _try(self, model: str, input_tokens: int, limit: Optional[int]) -> Optional[Reservation]:
+        """Reserve the worst case of one call if it fits, applying the policy; the lock must be held."""
+        output_reserve = limit if limit is not None else UNLIMITED_OUTPUT_RESERVE
+        tokens, usd = input_tokens + output_reserve, self._cost(model, input_tokens, output_reserve)
+        if self._fits(tokens, usd):
+            return Reservation(model, limit, tokens, usd)
+        if self.policy == 'cheaper-model' and not self.switched and self.fallback_model and model != self.fallback_model:
+            usd = self._cost(self.fallback_model, input_tokens, output_reserve)
+            if self._fits(tokens, usd):
+                self.switched = True
+                print(f"Budget: switching to {self.fallback_model} for the rest of the run", file=sys.stderr)
+                return Reservation(self.fallback_model, limit, tokens, usd)
+        if self.policy == 'lower-limit':
+            lowered = min(self._affordable_output(model, input_tokens), output_reserve)
+            if lowered >= self.min_limit:
+                self.lowered_calls += 1
+                return Reservation(model, lowered, input_tokens + lowered, self._cost(model, input_tokens, lowered))
+        return None
+
+    def reserve(self, model: str, input_tokens: int, limit: Optional[int]) -> Reservation:
+        """Reserve a call's worst case before sending it; raises BudgetExhausted if it cannot fit."""
+        input_tokens = self._estimate_input(input_tokens)
+        with self.condition:
+            while True:
+                if self.exhausted:
+                    raise BudgetExhausted(self.exhausted)
+                reservation = self._try(self.fallback_model if self.switched else model, input_tokens, limit)
+                if reservation is not None:
+                    self.reserved_tokens += reservation.tokens
+                    self.reserved_usd += reservation.usd
+                    self.in_flight += 1
+                    return reservation
+                if not self.in_flight:
+                    output_needed = self.min_limit if self.policy == 'lower-limit' else (limit if limit is not None else UNLIMITED_OUTPUT_RESERVE)
+                    self.exhausted = f"next call needs up to {input_tokens + output_needed} tokens; {self.remaining()}"
+                    self.condition.notify_all()
+                    raise BudgetExhausted(self.exhausted)
+                # Settling calls usually frees part of their reservation
+                self.condition.wait()
+
+    def _unreserve(self, reservation: Reservation) -> None:
+        self.reserved_tokens -= reservation.tokens
+        self.reserved_usd -= reservation.usd
+        self.in_flight -= 1
+        self.condition.notify_all()
+
+    def settle(self, reservation: Reservation, input_tokens: int, output_tokens: int) -> None:
+        """Replace a call's reservation with its actual usage."""
+        with self.condition:
+            self._unreserve(reservation)
+            self.spent_tokens += input_tokens + output_tokens
+            self.spent_usd += self._cost(reservation.model, input_tokens, output_tokens)
+
+    def release(self, reservation: Reservation) -> None:
+        """Drop the reservation of a call that failed without usage."""
+        with self.condition:
+            self._unreserve(reservation)
+
+    def remaining(self) -> str:
+        """Describe what is left of each limit, for messages."""
+        parts = []
+        if self.max_tokens is not None:
+            parts.append(f"{self.max_tokens - self.spent_tokens} of {self.max_tokens} tokens left")
+        if self.max_usd is not None:
+            parts.append(f"${self.max_usd - self.spent_usd:.4f} of ${self.max_usd:.2f} left")
+        return ', '.join(parts)
+
+    def print_stats(self) -> None:
+        """Print spend against the limits and any policy actions to stderr."""
+        print("---- Budget ----", file=sys.stderr)
+        if self.max_tokens is not None:
+            print(f"Tokens spent: {self.spent_tokens} of {self.max_tokens}", file=sys.stderr)
+        if self.max_usd is not None:
+            print(f"Cost: ${self.spent_usd:.4f} of ${self.max_usd:.2f}", file=sys.stderr)
+        if self.switched:
+            print(f"Switched to cheaper model: {self.fallback_model}", file=sys.stderr)
+        if self.lowered_calls:
+            print(f"Calls with lowered limit: {self.lowered_calls}", file=sys.stderr)
@@ -0,0 +1,149 @@
+# cllm hedged requests: duplicate slow calls to cut tail latency
+
+# (c) Copyright Matthew Wallace 2024; Licensed under Apache-2.0 Text version: https://www.apache.org/licenses/LICENSE-2.0.txt (see LICENSE)
+
+import sys
+import time
+import queue
+import threading
+from collections import deque
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+LATENCY_WINDOW = 500
+MIN_LATENCY_SAMPLES = 20
+
+
+class Hedger:
+    """Race a backup request against one that is slower than the observed latency quantile.
+
+    The threshold adapts to the recent latencies of completed attempts. Until
+    MIN_LATENCY_SAMPLES are seen, initial_delay is used (None: do not hedge yet).
+    Hedges are capped at max_rate of all requests. The synchronous OpenAI client
+    cannot abort a request in flight, so the losing attempt is abandoned and its
+    result discarded. Its prompt is billed either way, so it is counted as waste
+    when the winner arrives (from the winner's usage, as both sent the same
+    request); its output tokens are added if it finishes before exit.
+    """
+
+    def __init__(self, quantile: float = 0.95, max_rate: float = 0.1, initial_delay: Optional[float] = None):
+        self.quantile = quantile
+        self.max_rate = max_rate
+        self.initial_delay = initial_delay
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.hedges = 0
+        self.backup_wins = 0
+        self.wasted_input_tokens = 0
+        self.wasted_output_tokens = 0
+        self.abandoned_in_flight = 0
+
+    def threshold(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None if there is no basis yet."""
+        with self.lock:
+            if len(self.latencies) < MIN_LATENCY_SAMPLES:
+                return self.initial_delay
+            ordered = sorted(self.latencies)
+        return ordered[min(int(self.quantile * len(ordered)), len(ordered) - 1)]
+
+    def _claim_hedge(self) -> bool:
+        with self.lock:
+            if self.hedges + 1 > self.max_rate * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    @staticmethod
+    def _usage(response, field: str) -> int:
+        return getattr(getattr(response, 'usage', None), field, 0) or 0
+
+    def run(self, primary: Callable[[], object], backup: Callable[[], object]):
+        """Return the first successful result of primary, or of backup if primary is slow."""
+        with self.lock:
+            self.requests += 1
+        outcomes = queue.Queue()
+        state = {'winner': None, 'outstanding': 0}
+
+        def attempt(fn, label):
+            start = time.monotonic()
+            try:
+                result, error = fn(), None
+            except Exception as e:
+                result, error = None, e
+            report = False
+            with self.lock:
+                state['outstanding'] -= 1
+                if error is None:
+                    self.latencies.append(time.monotonic() - start)
+                if state['winner'] is not None:
+                    # An abandoned attempt finishing late; its prompt was counted already
+                    self.abandoned_in_flight -= 1
+                    if error is None:
+                        self.wasted_output_tokens += self._usage(result, 'completion_tokens')
+                elif error is None:
+                    state['winner'] = label
+                    report = True
+                    abandoned = state['outstanding']
+                    self.abandoned_in_flight += abandoned
+                    self.wasted_input_tokens += abandoned * self._usage(result, 'prompt_tokens')
+                else:
+                    # A failure is only final if no other attempt can still succeed
+                    report = state['outstanding'] == 0
+            if report:
+                outcomes.put((label, result, error))
+
+        def launch(fn, label):
+            with self.lock:
+                state['outstanding'] += 1
+            threading.Thread(target=attempt, args=(fn, label), daemon=True).start()
+
+        launch(primary, 'primary')
+        delay = self.threshold()
+        try:
+            label, result, error = outcomes.get(timeout=delay)
+        except queue.Empty:
+            if self._claim_hedge():
+                launch(backup, 'backup')
+            label, result, error = outcomes.get()
+
+        if error is not None:
+            raise error
+        if label == 'backup':
+            with self.lock:
+                self.backup_wins += 1
+        return result
+
+    def print_stats(self) -> None:
+        """Print hedge counts, wins and wasted tokens to stderr."""
+        print("---- Hedging ----", file=sys.stderr)
+        rate = self.hedges / self.requests if self.requests else 0.0
+        print(f"Hedged requests: {self.hedges} of {self.requests} ({rate:.1%}; cap {self.max_rate:.1%})", file=sys.stderr)
+        print(f"Backup won: {self.backup_wins}", file=sys.stderr)
+        with self.lock:
+            wasted_input, wasted_output, in_flight = self.wasted_input_tokens, self.wasted_output_tokens, self.abandoned_in_flight
+        print(f"Wasted tokens (abandoned attempts): {wasted_input} input, {wasted_output} output", file=sys.stderr)
+        if in_flight:
+            print(f"Abandoned attempts still running: {in_flight} (their output tokens are not counted)", file=sys.stderr)
+        threshold = self.threshold()
+        if threshold is not None:
+            print(f"Current hedge threshold (p{self.quantile * 100:g}): {threshold:.2f} seconds", file=sys.stderr)
+
+
+class HedgedClient:
+    """OpenAI client wrapper whose chat.completions.create is hedged; everything else goes to the primary."""
+
+    def __init__(self, primary, hedger: Hedger, alternate=None):
+        self._primary = primary
+        self._alternate = alternate or primary
+        self.hedger = hedger
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        return self.hedger.run(
+            lambda: self._primary.chat.completions.create(**kwargs),
+            lambda: self._alternate.chat.completions.create(**kwargs),
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._primary, name)
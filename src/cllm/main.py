@@ -9,18 +9,38 @@
 import os
 import sys
 import select
+import stat
 import argparse
 import openai
-import tiktoken
 from gitignore_parser import parse_gitignore
 import time
 import json
-from tqdm import tqdm
-from typing import List, Optional, Generator, Tuple
+import re
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Generator, Tuple
 import pyperclip
 import subprocess
 import httpx
 from dotenv import load_dotenv, find_dotenv
+from cllm.hedging import Hedger, HedgedClient
+from cllm.telemetry import DEFAULT_METRICS_INTERVAL, Telemetry
+from cllm.prompts import CompiledPrompt, PromptLibrary, compile_prompt, expansion_key
+from cllm.pipeline import PipelineRunner, load_pipeline_spec
+from cllm.budget import BUDGET_POLICIES, DEFAULT_MIN_LIMIT, EXIT_BUDGET_EXHAUSTED, Budget, BudgetExhausted
+from cllm.sharding import ShardWriter, assign_files, parse_shard_spec, read_shard_outputs, shard_of_index
+from cllm.models import (
+    FALLBACK_CONTEXT_FACTOR,
+    MESSAGE_OVERHEAD_TOKENS,
+    MODELS_CONFIG_PATH,
+    auto_context_length,
+    lookup_model,
+    lookup_price,
+    query_server_context_window,
+    resolve_encoder,
+)
 
 # Load environment variables from .env files
 # Search for .env file starting from current directory up to root
@@ -43,8 +63,38 @@ DEFAULT_SYSTEM = (
     "As a rule if you are outputting code, as this is CLI, that means you must avoid ```bash``` type enclosures unless specifically asked for or they were part of the context."
 )
 
+# Default -x/--expand-prompt instructions; {prompt} is the user's prompt
+DEFAULT_EXPAND_PROMPT = (
+    "Act as an elite prompt engineer working on an important project. The user is about to call an LLM in a bash pipeline, "
+    "using the LLM as a super-sophisticated sed/awk/etc, but with high-intelligence transformation. You must expand the simple "
+    "prompt to a fully fleshed-out prompt. Your prompt MUST include instructions to the LLM to be mindful of this circumstance "
+    "(bash pipeline) and instruct it to not output backticks or any such thing. You may see tokens in the prompt such as "
+    "{{context}} or {{filename}}; your prompt should use those verbatim; after your prompt is returned, when we call the LLM with "
+    "it, those strings will be substituted. Ensure the LLM understands it must avoid any extraneous output; no backticks, no "
+    "extemporaneous discussion. If the request is unfulfillable and the LLM believes it cannot properly produce a reply, it should "
+    "return the string 'False ({{failure_reason}})' where failure_reason is its reason; it should understand that will go to stderr "
+    "and the original input will go to stdout to attempt to cause a minimal disruption. "
+    "Tell the LLM to use newlines judiciously; we will neither add nor remove them; it should output them typically if a newline is "
+    "part of the input, but if the user is instructing it to, say, concatenate multiple lines in a way then it may not want to "
+    "put a newline in the output. "
+    "Additionally, if the user prompt does not contain the slug '{{context}}' then there is nowhere for the user input to go; which "
+    "means you must tell the model to ADD the '{{context}}' slug at the end, so that when we format the stdin input it is inserted. "
+    "You must now craft the prompt with these requirements in mind. Both you and the LLM should take a deep breath, think step by step, "
+    "output the most optimal output, being very mindful of the VERY STRICT requirements. If you and the LLM both are successful, you will "
+    "save lives. If you fail, innocent people may suffer grievous harm, so it is critical for you to succeed, and for the LLM to succeed, and you should "
+    "do your absolute best. Here is the prompt, with a single space after the colon and no other formatting: {prompt}"
+)
+
 TRUTHY_STRINGS = {"1", "true", "t", "yes", "y", "on"}
 
+# The 'False (reason)' reply the expand-prompt text asks for on unfulfillable requests
+FALSE_RESPONSE_RE = re.compile(r"^'?False\s*\(")
+
+# -gcm: per-file diff summaries are cached in the git dir, keyed by blob hashes
+GCM_CACHE_FILE = 'cllm-gcm-cache.json'
+GCM_CACHE_MAX_ENTRIES = 2000
+GCM_MAX_WORKERS = 8
+
 
 def is_truthy(value: Optional[str]) -> bool:
     """Return True if the provided string represents a truthy value."""
@@ -123,8 +173,8 @@ def is_file_ignored_by_gitignore(file_path: str, gitignore_map: dict) -> bool:
             print(f"Error checking file '{normalized_file_path}' against .gitignore in '{directory}': {e}", file=sys.stderr)
     return False
 
-def call_openai_api(client, model: str, prompt: str, system_message: Optional[str] = None, limit: Optional[int] = None, temperature: Optional[float] = None, verbose: bool = False) -> Tuple[str, float]:
-    """Call the OpenAI API with the given parameters."""
+def call_openai_api(client, model: str, prompt: str, system_message: Optional[str] = None, limit: Optional[int] = None, temperature: Optional[float] = None, verbose: bool = False) -> Tuple[str, float, Optional[Tuple[int, int]]]:
+    """Call the OpenAI API with the given parameters; returns the content, elapsed time and (input, output) tokens billed, if reported."""
     messages = []
     if system_message == '':
         system_message = None
@@ -163,19 +213,25 @@ def call_openai_api(client, model: str, prompt: str, system_message: Optional[st
     if verbose:
         print(f"Raw response:\n\t{str(response)}\n----------------\n\n", file=sys.stderr)
 
-    return response.choices[0].message.content, elapsed_time
+    usage = getattr(response, 'usage', None)
+    billed = None
+    if getattr(usage, 'prompt_tokens', None) is not None and getattr(usage, 'completion_tokens', None) is not None:
+        billed = (usage.prompt_tokens, usage.completion_tokens)
+
+    return response.choices[0].message.content, elapsed_time, billed
 
 def count_tokens(text: str, encoder) -> int:
     """Count the number of tokens in the given text using the specified encoder."""
     return len(encoder.encode(text))
 
 def get_files_and_sizes(directory: str, extensions: Optional[List[str]], file_filter: Optional[str], gitignore_map: dict) -> List[Tuple[str, int]]:
-    """Get a list of files and their sizes in the directory."""
+    """Get a list of files and their sizes in the directory, in sorted path order so every run (and --shard worker) agrees."""
     files_and_sizes = []
     visited_inodes = set()  # To keep track of visited inodes to prevent infinite loops
 
-    for root, _, files in os.walk(directory):
-        for file in files:
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
             if any(file.endswith(ext) for ext in extensions):
                 if file_filter and file_filter not in os.path.join(root, file):
                     continue
@@ -193,44 +249,768 @@ def get_files_and_sizes(directory: str, extensions: Optional[List[str]], file_fi
 
     return files_and_sizes
 
-def process_files(directory: str, context_length: int, extensions: Optional[List[str]], file_filter: Optional[str], verbose: bool, token_count_mode: bool, encoder, gitignore_map: dict) -> Generator[Tuple[str, str, str], None, None]:
+def process_files(directory: str, context_length: int, extensions: Optional[List[str]], file_filter: Optional[str], verbose: bool, token_count_mode: bool, encoder, gitignore_map: dict, files_and_sizes: Optional[List[Tuple[str, int]]] = None) -> Generator[Tuple[str, str, str], None, None]:
     """Process files in the directory with the given parameters and yield chunks."""
-    files_and_sizes = get_files_and_sizes(directory, extensions, file_filter, gitignore_map)
+    if files_and_sizes is None:
+        files_and_sizes = get_files_and_sizes(directory, extensions, file_filter, gitignore_map)
 
-    for file_path, file_size in tqdm(files_and_sizes, desc="Processing files", unit="B", unit_scale=True, disable=not verbose):
+    for file_path, file_size in files_and_sizes:
         start_line = 1
         chunk = ""
+        token_count = 0
         for line in read_file_in_chunks(file_path, 100):  # Read in chunks of 100 lines
-            chunk += line + "\n"
-            token_count = count_tokens(chunk, encoder)
+            block = line + "\n"
+            chunk += block
+            # Keep a running count so each block is encoded once; merges across block boundaries make
+            # it approximate, so count the whole chunk exactly before deciding to split
+            token_count += count_tokens(block, encoder)
+            if token_count > context_length:
+                token_count = count_tokens(chunk, encoder)
             if verbose:
                 print(f"Processing {file_path}, start_line {start_line}, token_count {token_count}", file=sys.stderr)
-            if token_count > context_length:
-                split_point = chunk[:context_length].rfind(' ')
-                if split_point == -1:
-                    split_point = context_length
+            while token_count > context_length:
+                # Split on the last space within the first context_length tokens
+                head = encoder.decode(encoder.encode(chunk)[:context_length])
+                split_point = head.rfind(' ')
+                if split_point <= 0:
+                    split_point = len(head)
                 chunk_to_send = chunk[:split_point]
                 remaining = chunk[split_point:].strip()
                 yield file_path, start_line, chunk_to_send
                 start_line += chunk_to_send.count('\n')
                 chunk = remaining
+                token_count = count_tokens(chunk, encoder)
         if chunk:
             yield file_path, start_line, chunk
 
+class WorkItem(NamedTuple):
+    """One unit of input: a file chunk, stdin line or chunk, or clipboard chunk."""
+    index: int
+    context: str
+    filename: Optional[str] = None
+    startline: Optional[int] = None
+    passthrough: bool = False  # emit an empty line without calling the API
+    size: int = 0  # bytes of input covered, for progress and ETA
+    position: Tuple[int, ...] = ()  # sort key in the single-node output order, for --shard
+
+class CallLimitReached(Exception):
+    """-n/--max-inference-calls API calls have already been made or started."""
+
+class Stats:
+    """Thread-safe API usage counters for --stats."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.api_time = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.api_calls = 0
+        self.calls_claimed = 0  # started calls, counted against -n
+        self.cascade_models = 0
+        self.cascade_answers = Counter()  # level -> items answered there
+        self.escalations = Counter()  # (level, reason) -> count
+        # Live progress, read by Telemetry for -b and --metrics-file
+        self.start_time = time.time()
+        self.in_flight = 0
+        self.errors = 0
+        self.items_read = 0
+        self.items_done = 0
+        self.bytes_done = 0
+        self.total_bytes: Optional[int] = None
+        self.total_files: Optional[int] = None  # with -d
+        self.files_started = 0
+
+    def record(self, elapsed_time: float, input_tokens: int, output_tokens: int) -> None:
+        """Add one completed API call's time and token counts."""
+        with self.lock:
+            self.api_time += elapsed_time
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.api_calls += 1
+
+    def claim_call(self, max_calls: Optional[int]) -> bool:
+        """Count a call against max_calls (None: unlimited) before it starts; False once they are used up."""
+        with self.lock:
+            if max_calls and self.calls_claimed >= max_calls:
+                return False
+            self.calls_claimed += 1
+            return True
+
+    def call_started(self) -> None:
+        """Count a call as in flight."""
+        with self.lock:
+            self.in_flight += 1
+
+    def call_finished(self, failed: bool = False) -> None:
+        """Count a call as no longer in flight, and as an error if it failed."""
+        with self.lock:
+            self.in_flight -= 1
+            if failed:
+                self.errors += 1
+
+    def item_done(self, item: 'WorkItem') -> None:
+        """Count a finished item and the input bytes it covered."""
+        with self.lock:
+            self.items_done += 1
+            self.bytes_done += item.size
+
+    def record_escalation(self, level: int, reason: str) -> None:
+        """Count an item sent past cascade level (0-based) for reason."""
+        with self.lock:
+            self.escalations[(level, reason)] += 1
+
+    def record_cascade_answer(self, level: int, model_count: int) -> None:
+        """Count an item answered at cascade level (0-based) of a model_count-model cascade."""
+        with self.lock:
+            self.cascade_answers[level] += 1
+            self.cascade_models = max(self.cascade_models, model_count)
+
+    def print(self) -> None:
+        """Print the run totals to stderr."""
+        print("\n---- Stats ----", file=sys.stderr)
+        print(f"Total execution time (API calls): {self.api_time:.2f} seconds", file=sys.stderr)
+        print(f"Total input tokens: {self.input_tokens}", file=sys.stderr)
+        print(f"Total output tokens: {self.output_tokens}", file=sys.stderr)
+        if self.api_time:
+            print(f"Input tokens/sec: {self.input_tokens / self.api_time:.2f}", file=sys.stderr)
+            print(f"Output tokens/sec: {self.output_tokens / self.api_time:.2f}", file=sys.stderr)
+        print(f"Total API calls made: {self.api_calls}", file=sys.stderr)
+        if self.cascade_models > 1:
+            self.print_cascade()
+
+    def print_cascade(self) -> None:
+        """Print per-level answer counts and escalation reasons to stderr."""
+        items = sum(self.cascade_answers.values())
+        print("---- Cascade ----", file=sys.stderr)
+        for level in range(self.cascade_models):
+            answered = self.cascade_answers[level]
+            print(f"Answered at level {level + 1}: {answered} ({answered / items:.1%})" if items else f"Answered at level {level + 1}: 0", file=sys.stderr)
+        for level in range(self.cascade_models - 1):
+            reasons = {reason: n for (lvl, reason), n in self.escalations.items() if lvl == level}
+            escalated = sum(reasons.values())
+            reached = escalated + self.cascade_answers[level]
+            rate = escalated / reached if reached else 0.0
+            detail = ', '.join(f"{reason}: {n}" for reason, n in sorted(reasons.items()))
+            print(f"Escalated from level {level + 1}: {escalated} ({rate:.1%}){' - ' + detail if detail else ''}", file=sys.stderr)
+
+def split_text_by_tokens(text: str, context_length: int, encoder) -> Generator[str, None, None]:
+    """Split text into chunks of at most context_length tokens, preferring to break on spaces."""
+    while text:
+        tokens = encoder.encode(text)
+        if len(tokens) <= context_length:
+            yield text
+            return
+        head = encoder.decode(tokens[:context_length])
+        split_point = head.rfind(' ')
+        if split_point <= 0:
+            split_point = len(head)
+        yield text[:split_point]
+        text = text[split_point:]
+
+def read_stdin_if_available() -> Optional[str]:
+    """Read stdin if it is a pipe, or a tty with pending input; None if there is nothing to read."""
+    if not sys.stdin.isatty():
+        # Blocking read from pipe
+        return sys.stdin.read()
+    try:
+        rlist, _, _ = select.select([sys.stdin], [], [], 0.1)
+    except select.error:
+        return None
+    return sys.stdin.read() if rlist else None
+
+def input_size(text: str) -> int:
+    """Size in bytes of a piece of input text."""
+    return len(text.encode('utf-8', errors='replace'))
+
+def size_file_chunks(chunks, files_and_sizes: List[Tuple[str, int]]) -> Generator[Tuple[str, int, str, int], None, None]:
+    """Add to each (file_path, start_line, chunk) from process_files the file bytes it covers.
+
+    Chunks are stripped and split between words, so their text does not add up to
+    the file. Each file's last chunk also covers the rest of the file, and of any
+    files before it that yielded no chunks, so the sizes sum to the files' total.
+    Finding the last chunk takes one chunk of lookahead.
+    """
+    order = {file_path: i for i, (file_path, _) in enumerate(files_and_sizes)}
+    pending = None
+    file_left = 0  # bytes of the pending chunk's file not yet covered
+    next_file = 0  # first file process_files has not reached
+    for file_path, start_line, chunk in chunks:
+        if pending is not None and file_path == pending[0]:
+            yield pending
+        else:
+            reached = order[file_path]
+            skipped = sum(size for _, size in files_and_sizes[next_file:reached])
+            next_file = reached + 1
+            if pending is not None:
+                yield pending[:3] + (pending[3] + file_left + skipped,)
+                skipped = 0
+            file_left = files_and_sizes[reached][1] + skipped
+        size = min(input_size(chunk), file_left)
+        file_left -= size
+        pending = (file_path, start_line, chunk, size)
+    if pending is not None:
+        skipped = sum(size for _, size in files_and_sizes[next_file:])
+        yield pending[:3] + (pending[3] + file_left + skipped,)
+
+def iter_work_items(args, encoder, extensions: Optional[List[str]], stats: Optional[Stats] = None) -> Generator[WorkItem, None, None]:
+    """Yield the work items for this run from -d, -C or stdin, reading and chunking the input once.
+
+    The total input size, where it can be known up front, is set on stats for the ETA.
+    With --shard, only this worker's share of the items is yielded.
+    """
+    stats = stats or Stats()
+    shard = args.shard
+    if args.directory:
+        gitignore_map = load_gitignore_files(args.directory)
+        files_and_sizes = get_files_and_sizes(args.directory, extensions, args.filter, gitignore_map)
+        file_index = {file_path: i for i, (file_path, _) in enumerate(files_and_sizes)}
+        if shard:
+            # Whole files go to one shard, so chunking and startlines match a single-node run
+            assignment = assign_files(files_and_sizes, args.directory, shard.count)
+            files_and_sizes = [entry for entry, owner in zip(files_and_sizes, assignment) if owner == shard.index]
+        stats.total_bytes = sum(size for _, size in files_and_sizes)
+        stats.total_files = len(files_and_sizes)
+        index = 0
+        current_file, chunk_number = None, 0
+        chunks = process_files(
+            directory=args.directory,
+            context_length=args.context_length,
+            extensions=extensions,
+            file_filter=args.filter,
+            verbose=args.verbose,
+            token_count_mode=args.tc,
+            encoder=encoder,
+            gitignore_map=gitignore_map,
+            files_and_sizes=files_and_sizes,
+        )
+        for file_path, start_line, chunk, size in size_file_chunks(chunks, files_and_sizes):
+            if args.verbose:
+                print(f"Input Processing: file_path: {file_path}, start_line: {start_line}, chunk: {chunk}", file=sys.stderr)
+            if file_path != current_file:
+                current_file, chunk_number = file_path, 0
+                stats.files_started += 1
+            stats.items_read += 1
+            yield WorkItem(index, chunk, file_path, start_line, size=size, position=(file_index[file_path], chunk_number))
+            index += 1
+            chunk_number += 1
+        return
+
+    for item in iter_input_items(args, encoder, stats):
+        if shard is None or shard_of_index(item.index, shard.count) == shard.index:
+            stats.items_read += 1
+            yield item._replace(position=(item.index,))
+
+def iter_input_items(args, encoder, stats: Stats) -> Generator[WorkItem, None, None]:
+    """Yield work items from -C or stdin: lines, or token-sized chunks with -S/-C."""
+    # Lines and chunks are hashed to shards, so a worker's share of the input size is an estimate
+    share = args.shard.count if args.shard else 1
+    index = 0
+    if args.clipboard:
+        text = pyperclip.paste()
+        single_string = True
+    elif not sys.stdin.isatty() and not args.single_string_stdin:
+        try:
+            # Known only when stdin is redirected from a file rather than a pipe
+            stdin_stat = os.fstat(sys.stdin.fileno())
+            if stat.S_ISREG(stdin_stat.st_mode):
+                stats.total_bytes = stdin_stat.st_size // share
+        except (OSError, ValueError):
+            pass
+        # Stream piped lines so work starts before the upstream command finishes
+        for line in sys.stdin:
+            size = input_size(line)
+            line = line.rstrip('\n')
+            passthrough = not args.send_empty and not line.strip()
+            yield WorkItem(index, line.strip(), passthrough=passthrough, size=size)
+            index += 1
+        return
+    else:
+        text = read_stdin_if_available()
+        if text is None:
+            # No input at all: send the prompt once with empty context
+            yield WorkItem(index, '')
+            return
+        single_string = args.single_string_stdin
+
+    stats.total_bytes = input_size(text) // share
+    if single_string:
+        for chunk in split_text_by_tokens(text.strip(), args.context_length, encoder):
+            yield WorkItem(index, chunk.strip(), size=input_size(chunk))
+            index += 1
+        return
+
+    for line in text.splitlines():
+        passthrough = not args.send_empty and not line.strip()
+        yield WorkItem(index, line.strip(), passthrough=passthrough, size=input_size(line) + 1)
+        index += 1
+
+def render_prompt(template: CompiledPrompt, item: WorkItem) -> str:
+    """Fill a compiled prompt template for a work item."""
+    return template.render(item.context, item.filename, item.startline)
+
+class OutputWriter:
+    """Write responses as plain lines (one prompt), tagged JSONL, or per-prompt files under a directory."""
+
+    def __init__(self, prompt_count: int, jsonl: bool = False, output_dir: Optional[str] = None):
+        self.prompt_count = prompt_count
+        self.jsonl = jsonl or (prompt_count > 1 and not output_dir)
+        self.files = []
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            self.files = [open(os.path.join(output_dir, f"prompt{k + 1}.txt"), 'w') for k in range(prompt_count)]
+
+    def write(self, item: WorkItem, prompt_index: int, response: str) -> None:
+        """Write one response as plain text, a JSONL record, or to the prompt's --output-dir file."""
+        if self.files:
+            print(response, file=self.files[prompt_index], flush=True)
+        elif self.jsonl:
+            record = {"prompt": prompt_index + 1, "index": item.index, "response": response}
+            if item.filename is not None:
+                record["filename"] = item.filename
+                record["startline"] = item.startline
+            print(json.dumps(record), flush=True)
+        else:
+            print(response, flush=True)
+
+    def close(self) -> None:
+        """Close the --output-dir files."""
+        for f in self.files:
+            f.close()
+
+def escalation_reason(response: str, output_tokens: int, limit: Optional[int], validate: Optional[str]) -> Optional[str]:
+    """Return why a --cascade response should go to the next model, or None if it is acceptable."""
+    text = response.strip() if response else ''
+    if not text:
+        return 'empty'
+    if FALSE_RESPONSE_RE.match(text):
+        return 'false'
+    if validate and not re.search(validate, response):
+        return 'validation'
+    if limit is not None and output_tokens >= limit:
+        return 'length'
+    return None
+
+def call_llm(client, args, prompt: str, encoder, stats: Stats, input_tokens: Optional[int] = None, model: Optional[str] = None, system: Optional[str] = None, limit: Optional[int] = None, temperature: Optional[float] = None) -> str:
+    """Call the API and record usage; without an explicit model, --cascade models are tried cheapest first.
+
+    Raises CallLimitReached once -n calls have been made. With a budget, each call
+    is reserved before it is sent and may raise BudgetExhausted.
+    """
+    models = [model] if model else (args.cascade or [args.model])
+    system = args.system if system is None else system
+    limit = args.limit if limit is None else limit
+    temperature = args.temperature if temperature is None else temperature
+    if input_tokens is None:
+        input_tokens = count_tokens(prompt, encoder)
+
+    for level, candidate in enumerate(models):
+        final = level == len(models) - 1
+        if not stats.claim_call(args.max_inference_calls):
+            raise CallLimitReached()
+        call_model, call_limit, reservation = candidate, limit, None
+        if args.budget:
+            reservation = args.budget.reserve(candidate, input_tokens, limit)
+            call_model, call_limit = reservation.model, reservation.limit
+            # After a switch to the cheaper model, escalating would only ask it again
+            final = final or call_model != candidate
+        stats.call_started()
+        try:
+            response, elapsed_time, billed = call_openai_api(client, call_model, prompt, system, call_limit, temperature, args.verbose)
+        except Exception:
+            stats.call_finished(failed=True)
+            if reservation:
+                args.budget.release(reservation)
+            if final:
+                raise
+            stats.record_escalation(level, 'error')
+            continue
+        stats.call_finished()
+        call_input_tokens, output_tokens = billed or (input_tokens, count_tokens(response, encoder))
+        stats.record(elapsed_time, call_input_tokens, output_tokens)
+        if reservation:
+            args.budget.settle(reservation, call_input_tokens, output_tokens)
+        reason = None if final else escalation_reason(response, output_tokens, call_limit, args.cascade_validate)
+        if reason is None:
+            if len(models) > 1:
+                stats.record_cascade_answer(level, len(models))
+            return response
+        stats.record_escalation(level, reason)
+        if args.verbose:
+            print(f"Cascade: escalating from {call_model} ({reason})", file=sys.stderr)
+
+def call_prompt(client, args, template: CompiledPrompt, item: WorkItem, encoder, context_tokens: int, template_tokens: int, stats: Stats) -> str:
+    """Render one template for one item, call the API, and record usage."""
+    prompt = render_prompt(template, item)
+    return call_llm(client, args, prompt, encoder, stats, input_tokens=template_tokens + context_tokens)
+
+def run_prompts(client, args, templates: List[CompiledPrompt], items, encoder, stats: Stats, writer: OutputWriter) -> None:
+    """Fan each work item out to every prompt template concurrently, writing results in input order."""
+    # Each template and each context is tokenized once, however many prompts share it
+    template_tokens = [count_tokens(render_prompt(template, WorkItem(0, ' ')), encoder) for template in templates]
+    with ThreadPoolExecutor(max_workers=len(templates)) as executor:
+        for item in items:
+            if item.passthrough:
+                for k in range(len(templates)):
+                    writer.write(item, k, "")
+                stats.item_done(item)
+                continue
+            remaining = len(templates)
+            if args.max_inference_calls:
+                remaining = args.max_inference_calls - stats.calls_claimed
+                if remaining <= 0:
+                    break
+            context_tokens = count_tokens(item.context, encoder)
+            futures = [
+                executor.submit(call_prompt, client, args, template, item, encoder, context_tokens, template_tokens[k], stats)
+                for k, template in enumerate(templates[:remaining])
+            ]
+            error = None
+            for k, future in enumerate(futures):
+                try:
+                    response = future.result()
+                except Exception as e:
+                    # Still write what the item's other prompts produced before stopping
+                    error = error or e
+                    continue
+                writer.write(item, k, response)
+            if isinstance(error, CallLimitReached):
+                return  # a --cascade escalation hit -n
+            if error is not None:
+                raise error
+            stats.item_done(item)
+
+def run_pipeline(client, args, stages, templates: List[CompiledPrompt], items, encoder, stats: Stats, shard_writer: Optional[ShardWriter] = None) -> None:
+    """Stream work items through --pipeline stages, sharing one client and encoder; templates are the compiled stage prompts.
+
+    Final lines are printed, or grouped per item into shard_writer records with --shard.
+    """
+    compiled = {id(stage): template for stage, template in zip(stages, templates)}
+
+    def call_stage(stage, context: str, origin: WorkItem) -> str:
+        item = WorkItem(origin.index, context, origin.filename, origin.startline)
+        prompt = render_prompt(compiled[id(stage)], item)
+        return call_llm(client, args, prompt, encoder, stats, model=stage.model, system=stage.system, limit=stage.limit, temperature=stage.temperature)
+
+    def should_stop() -> bool:
+        if args.budget and args.budget.exhausted:
+            return True
+        return bool(args.max_inference_calls) and stats.calls_claimed >= args.max_inference_calls
+
+    runner = PipelineRunner(stages, call_stage, args.send_empty)
+    inputs = ((None if item.passthrough else item.context, item) for item in items)
+    write, item_done = (lambda line: print(line, flush=True)), stats.item_done
+    if shard_writer is not None:
+        def item_done(item: WorkItem) -> None:
+            shard_writer.item_done(item)
+            stats.item_done(item)
+        write = shard_writer.write_line
+    try:
+        runner.run(inputs, write, should_stop, item_done)
+    except CallLimitReached:
+        # Items already queued stop at the -n cap; output before them has been written
+        pass
+
+def report_budget_exhausted(error: BudgetExhausted, stats: Stats) -> None:
+    """Report what a budget stop left undone, from what is known without reading the rest of the input."""
+    print(f"Budget exhausted: {error}", file=sys.stderr)
+    message = f"Stopped after {stats.items_done} items ({stats.items_read - stats.items_done} read but not completed)"
+    if stats.total_bytes is not None:
+        message += f"; {max(stats.total_bytes - stats.bytes_done, 0)} of {stats.total_bytes} input bytes not processed"
+    else:
+        message += "; remaining input size unknown"
+    if stats.total_files is not None:
+        message += f"; {stats.total_files - stats.files_started} of {stats.total_files} files not started"
+    print(message, file=sys.stderr)
+
+def merge_main(argv: List[str]) -> None:
+    """`cllm merge`: combine --shard outputs into the output a single-node run would have written."""
+    parser = argparse.ArgumentParser(prog='cllm merge', description='Merge the outputs of cllm --shard i/N runs into single-node output order')
+    parser.add_argument('shard_files', nargs='+', help='Output files of the --shard runs, in any order')
+    parser.add_argument('--jsonl', action='store_true', help='Write one JSON record per response, as cllm --jsonl would')
+    parser.add_argument('--output-dir', help='Write each prompt\'s responses to its own file, DIR/prompt<N>.txt, as cllm --output-dir would')
+    args = parser.parse_args(argv)
+
+    try:
+        header, records = read_shard_outputs(args.shard_files)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if header['pipeline']:
+        for record in records:
+            for line in record['lines']:
+                print(line)
+        return
+
+    # Item indexes are renumbered across shards, since -d workers only count their own chunks
+    writer = OutputWriter(header['prompts'], args.jsonl, args.output_dir)
+    index, last_position = -1, None
+    try:
+        for record in records:
+            if record['pos'] != last_position:
+                index, last_position = index + 1, record['pos']
+            item = WorkItem(index, '', record.get('filename'), record.get('startline'))
+            writer.write(item, record['prompt'] - 1, record['response'])
+    finally:
+        writer.close()
+
+def expand_prompts(client, args, library: PromptLibrary) -> List[str]:
+    """Expand each prompt with -x/--expand-prompt, reusing and saving expansions in the prompt library."""
+    expand_prompt = args.expand_prompt or DEFAULT_EXPAND_PROMPT
+    expanded_prompts = []
+    for i, prompt in enumerate(args.prompt):
+        key = expansion_key(prompt, expand_prompt, args.model)
+        name = args.save_template or f"expanded-{key[:8]}"
+        if args.save_template and len(args.prompt) > 1:
+            name = f"{name}-{i + 1}"
+        entry = None if args.recompile else library.find(key)
+        if entry is None:
+            expanded_prompt, _, _ = call_openai_api(client, args.model, expand_prompt.format(prompt=prompt), args.system, args.limit, args.temperature, args.verbose)
+            # LLM-written prompts may contain literal braces (e.g. JSON); keep only our placeholders live
+            template = compile_prompt(expanded_prompt, escape_unknown=True).template
+            entry = library.add(name, template, prompt, key, args.model)
+            if args.verbose:
+                print(f"Prompt library: saved {entry.name}@{entry.version}", file=sys.stderr)
+        else:
+            if args.verbose:
+                print(f"Prompt library: reusing {entry.name}@{entry.version}", file=sys.stderr)
+            if args.save_template:
+                # A cached expansion is still saved under the requested name
+                entry = library.add(name, entry.template, prompt, key, args.model)
+                if args.verbose:
+                    print(f"Prompt library: saved {entry.name}@{entry.version}", file=sys.stderr)
+        expanded_prompts.append(entry.template)
+    library.save()
+    return expanded_prompts
+
 def get_git_diff():
     """Get the git diff for staged changes."""
     try:
-        return subprocess.check_output(['git', 'diff', '--cached'], universal_newlines=True)
+        # --full-index gives complete blob hashes for the summary cache
+        return subprocess.check_output(['git', 'diff', '--cached', '--full-index'], universal_newlines=True)
     except subprocess.CalledProcessError:
         print("Error: Failed to get git diff. Are you in a git repository?", file=sys.stderr)
         return None
 
-def generate_commit_message(client, model, diff):
-    """Generate a commit message using the LLM."""
-    prompt = f"Below is a diff of all staged changes, coming from the command `git diff --cached`\n\nPlease generate a concise, one-line commit message for these changes:\n\n{diff}"
-    response, _ = call_openai_api(client, model, prompt, None, None, None, False)
+GIT_PATH_ESCAPES = {'a': 7, 'b': 8, 't': 9, 'n': 10, 'v': 11, 'f': 12, 'r': 13, '"': 34, '\\': 92}
+
+def unquote_git_path(path: str) -> str:
+    """Undo git's C-style quoting of paths with special characters, e.g. "b/caf\\303\\251.txt"."""
+    if len(path) < 2 or not (path.startswith('"') and path.endswith('"')):
+        return path
+    inner = path[1:-1]
+    raw = bytearray()
+    i = 0
+    while i < len(inner):
+        char = inner[i]
+        if char == '\\' and i + 1 < len(inner):
+            escaped = inner[i + 1]
+            if escaped in '01234567':
+                raw.append(int(inner[i + 1:i + 4], 8))
+                i += 4
+                continue
+            raw.append(GIT_PATH_ESCAPES.get(escaped, ord(escaped)))
+            i += 2
+            continue
+        raw.extend(char.encode('utf-8'))
+        i += 1
+    return raw.decode('utf-8', errors='replace')
+
+def diff_block_path(block: str) -> str:
+    """Return the (new) path of one file's diff block."""
+    # Only the lines before the first hunk; an added "++ x" line reads "+++ x"
+    header = re.split(r'(?m)^@@ ', block, 1)[0]
+    for marker in ('+++ ', '--- '):
+        match = re.search(r'(?m)^' + re.escape(marker) + r'(.*)$', header)
+        if match:
+            # git appends a tab to ---/+++ paths that contain spaces
+            path = unquote_git_path(match.group(1).rstrip('\t'))
+            if path != '/dev/null':
+                return path[2:] if path.startswith(('a/', 'b/')) else path
+    match = re.search(r'(?m)^rename to (.*)$', header)
+    if match:
+        return unquote_git_path(match.group(1))
+    # Binary files and mode changes: only the "diff --git" line names the file
+    first_line = header.split('\n', 1)[0]
+    if first_line.endswith('"'):
+        return unquote_git_path(first_line[first_line.rindex(' "b/') + 1:])[2:]
+    return first_line.rsplit(' b/', 1)[-1]
+
+def split_diff_by_file(diff: str) -> List[Tuple[str, str, str]]:
+    """Split a diff into (path, file_diff, blob_key) per file."""
+    files = []
+    for block in re.split(r'(?m)^(?=diff --git )', diff):
+        if not block.startswith('diff --git '):
+            continue
+        path = diff_block_path(block)
+        index_match = re.search(r'(?m)^index ([0-9a-f]+)\.\.([0-9a-f]+)', block)
+        if index_match:
+            blob_key = f"{path}:{index_match.group(1)}..{index_match.group(2)}"
+        else:
+            # Pure renames and mode changes have no index line
+            blob_key = f"{path}:{hashlib.sha256(block.encode('utf-8')).hexdigest()}"
+        files.append((path, block, blob_key))
+    return files
+
+def split_file_diff(file_diff: str, budget: int, encoder) -> List[str]:
+    """Split one file's diff into parts of at most budget tokens, on hunk and then line boundaries."""
+    pieces = re.split(r'(?m)^(?=@@ )', file_diff)
+    header, hunks = pieces[0], pieces[1:]
+    budget = max(budget - count_tokens(header, encoder), 1)
+
+    units = []
+    for hunk in hunks or [header]:
+        if count_tokens(hunk, encoder) <= budget:
+            units.append(hunk)
+            continue
+        # Oversized hunk: fall back to packing its lines
+        current = ''
+        for line in hunk.splitlines(keepends=True):
+            if current and count_tokens(current + line, encoder) > budget:
+                units.append(current)
+                current = ''
+            current += line
+        if current:
+            units.append(current)
+
+    parts = []
+    current = ''
+    for unit in units:
+        if current and count_tokens(current + unit, encoder) > budget:
+            parts.append(current)
+            current = ''
+        current += unit
+    if current:
+        parts.append(current)
+    if not hunks:
+        return parts
+    return [header + part for part in parts]
+
+def get_gcm_cache_path() -> Optional[str]:
+    """Return the path of the per-file summary cache inside the git dir."""
+    try:
+        git_dir = subprocess.check_output(['git', 'rev-parse', '--git-dir'], universal_newlines=True).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    return os.path.join(git_dir, GCM_CACHE_FILE)
+
+def load_gcm_cache(cache_path: Optional[str]) -> dict:
+    """Load cached per-file diff summaries keyed by model and blob hashes."""
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_gcm_cache(cache_path: Optional[str], cache: dict) -> None:
+    """Persist the summary cache, keeping only the most recent entries."""
+    if not cache_path:
+        return
+    entries = list(cache.items())[-GCM_CACHE_MAX_ENTRIES:]
+    tmp_path = cache_path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(entries), f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Warning: unable to write commit summary cache: {e}", file=sys.stderr)
+
+def summarize_diff_part(client, model, path, part, position=""):
+    """Summarize one part of one file's diff."""
+    prompt = (
+        f"Below is a portion of the staged changes to `{path}`{position}, coming from the command `git diff --cached`\n\n"
+        f"Summarize what changed in one or two short sentences, for use in writing a commit message:\n\n{part}"
+    )
+    response, _, _ = call_openai_api(client, model, prompt, None, None, None, False)
     return response.strip()
 
+def summarize_diff(client, model, diff, budget, encoder):
+    """Map step: summarize every part of every file of a large diff concurrently, reusing cached summaries."""
+    cache_path = get_gcm_cache_path()
+    cache = load_gcm_cache(cache_path)
+    summaries = {}
+    pending = {}  # path -> (cache_key, futures of its parts)
+
+    with ThreadPoolExecutor(max_workers=GCM_MAX_WORKERS) as executor:
+        for path, file_diff, blob_key in split_diff_by_file(diff):
+            cache_key = f"{model}|{blob_key}"
+            if cache_key in cache:
+                summaries[path] = cache.pop(cache_key)
+                cache[cache_key] = summaries[path]  # mark as recently used
+                continue
+            parts = split_file_diff(file_diff, budget, encoder)
+            # Parts are submitted individually so one huge file is summarized in parallel too
+            futures = [
+                executor.submit(summarize_diff_part, client, model, path, part, f" (part {i + 1} of {len(parts)})" if len(parts) > 1 else "")
+                for i, part in enumerate(parts)
+            ]
+            pending[path] = (cache_key, futures)
+            summaries[path] = None  # preserve diff order
+
+        for path, (cache_key, futures) in pending.items():
+            summaries[path] = ' '.join(future.result() for future in futures)
+            cache[cache_key] = summaries[path]
+
+    if pending:
+        save_gcm_cache(cache_path, cache)
+    return summaries
+
+def reduce_summaries(client, model, lines, budget, encoder):
+    """Condense summary lines in batches of at most budget tokens until they fit the budget together."""
+    while len(lines) > 1 and count_tokens('\n'.join(lines), encoder) > budget:
+        batches = []
+        current = []
+        for line in lines:
+            if current and count_tokens('\n'.join(current + [line]), encoder) > budget:
+                batches.append(current)
+                current = []
+            current.append(line)
+        batches.append(current)
+        if len(batches) == len(lines):
+            break  # every line alone fills the budget; nothing left to merge
+
+        def condense(batch):
+            prompt = (
+                "Below are summaries of part of the staged changes, coming from the command `git diff --cached`\n\n"
+                "Condense them into a few short bullet points, for use in writing a commit message:\n\n" + '\n'.join(batch)
+            )
+            response, _, _ = call_openai_api(client, model, prompt, None, None, None, False)
+            return response.strip()
+
+        with ThreadPoolExecutor(max_workers=GCM_MAX_WORKERS) as executor:
+            lines = list(executor.map(condense, batches))
+    return lines
+
+def generate_commit_message(client, model, diff, budget=None, encoder=None):
+    """Generate a commit message using the LLM, map-reducing diffs that exceed the budget."""
+    if budget is None or encoder is None or count_tokens(diff, encoder) <= budget:
+        prompt = f"Below is a diff of all staged changes, coming from the command `git diff --cached`\n\nPlease generate a concise, one-line commit message for these changes:\n\n{diff}"
+    else:
+        summaries = summarize_diff(client, model, diff, budget, encoder)
+        # Thousands of files can overflow the context even as one-line summaries
+        lines = reduce_summaries(client, model, [f"- {path}: {summary}" for path, summary in summaries.items()], budget, encoder)
+        summary_text = '\n'.join(lines)
+        prompt = f"Below are per-file summaries of all staged changes, coming from the command `git diff --cached`\n\nPlease generate a concise, one-line commit message for these changes:\n\n{summary_text}"
+    response, _, _ = call_openai_api(client, model, prompt, None, None, None, False)
+    return response.strip()
+
+def generate_in_background(fn, *fn_args) -> Future:
+    """Run fn on a daemon thread so an unused result never delays exit."""
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*fn_args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
 def commit_changes(message):
     """Commit the changes with the given message."""
     try:
@@ -241,13 +1021,16 @@ def commit_changes(message):
         print("Commit failed. Please check your changes and try again.", file=sys.stderr)
         return False
 
-def gcm_feature(args, client):
+def gcm_feature(args, client, encoder, budget):
     """Generate a commit message and handle user interaction."""
     diff = get_git_diff()
     if not diff:
         return
 
-    commit_message = generate_commit_message(client, args.model, diff)
+    generate_args = (client, args.model, diff, budget, encoder)
+    commit_message = generate_commit_message(*generate_args)
+    # Prefetch the next candidate while the user reads this one so (r) is instant
+    next_message = generate_in_background(generate_commit_message, *generate_args)
 
     while True:
         print("\nProposed commit message:")
@@ -262,8 +1045,13 @@ def gcm_feature(args, client):
             if new_message and commit_changes(new_message):
                 break
         elif choice == 'r':
-            print("Regenerating commit message...")
-            commit_message = generate_commit_message(client, args.model, diff)
+            if not next_message.done():
+                print("Regenerating commit message...")
+            try:
+                commit_message = next_message.result()
+            except Exception:
+                commit_message = generate_commit_message(*generate_args)
+            next_message = generate_in_background(generate_commit_message, *generate_args)
         elif choice == 'c':
             print("Commit cancelled.")
             break
@@ -272,10 +1060,19 @@ def gcm_feature(args, client):
 
 def main():
     """Main function to parse arguments and process files or stdin."""
+    if sys.argv[1:2] == ['merge']:
+        merge_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="Composable command-line interactions with LLM APIs")
     parser.add_argument('-d', '--directory', help='Directory to process')
-    parser.add_argument('-p', '--prompt', help='User prompt')
-    parser.add_argument('-c', '--context-length', type=int, default=4096, help='Context length for splitting files/input (default: 4096)')
+    parser.add_argument('-p', '--prompt', action='append', help='User prompt; repeat to run several prompts over a single pass of the input (output is tagged JSONL unless --output-dir is set)')
+    parser.add_argument('--jsonl', action='store_true', help='Write one JSON record per response, tagged with prompt number, input index and filename/startline')
+    parser.add_argument('--pipeline', help='Run multi-stage prompts in one process: JSON file or inline JSON list of stages ({"prompt", "model", "system", "limit", "temperature", "concurrency", "single_string"}); items stream from stage to stage')
+    parser.add_argument('--output-dir', help='Write each prompt\'s responses to its own file, DIR/prompt<N>.txt')
+    parser.add_argument('-c', '--context-length', type=int, default=None, help='Context length for splitting files/input (default: model context window minus system prompt, prompt and --limit; 4096 if the window is unknown)')
+    parser.add_argument('--context-window', type=int, help='Context window of the model in tokens, for models not in the registry (see CLLM_MODELS)')
+    parser.add_argument('--tokenizer', help='Tokenizer for splits: a tiktoken encoding name (e.g. o200k_base) or path to a Hugging Face tokenizer.json')
     parser.add_argument('-s', '--summary', help='Summary prompt')
     parser.add_argument('-m', '--model', help='Model name; or deployment for Azure OpenAI (default: gpt-4o-2024-08-06 or "model" if -B is set)')
     parser.add_argument('--system', help='System message')
@@ -287,10 +1084,16 @@ def main():
     parser.add_argument('-l', '--limit', type=int, help='Limit output tokens (default: 1024; except for models matching "*o1*", then none)')
     parser.add_argument('-B', '--base-url', help='(Optional) Base URL for OpenAI-compatible API, defaults to the standard OpenAI API endpoint')
     parser.add_argument('--expand-prompt', help='Prompt for prompt expansion, passed without the input to let the LLM craft a better prompt')
-    parser.add_argument('-x', action='store_true', help='Expand the user prompt by pre-processing it with an LLM to try optimizing the result')
+    parser.add_argument('-x', action='store_true', help='Expand the user prompt by pre-processing it with an LLM to try optimizing the result; expansions are saved to the prompt library and reused')
+    parser.add_argument('--template', action='append', help='Use a prompt library template as the prompt: NAME (latest) or NAME@VERSION; repeatable')
+    parser.add_argument('--save-template', help='Name under which to save the -x/--expand-prompt expansion in the prompt library')
+    parser.add_argument('--recompile', action='store_true', help='Re-run -x/--expand-prompt even if the prompt library has a matching expansion, saving a new version')
+    parser.add_argument('--list-templates', action='store_true', help='List the prompt library templates and exit')
     parser.add_argument('-S', '--single-string-stdin', action='store_true', default=False, help='Treat all stdin as a single string instead of prompting with each line (default: False)')
     parser.add_argument('-o', '--overlap', type=int, help='Number of bytes to include before the split if the chunk is larger than the context')
-    parser.add_argument('-b', '--progress-bar', action='store_true', help='Display a progress bar based on the total bytes of the files processed')
+    parser.add_argument('-b', '--progress-bar', action='store_true', help='Display a live progress bar on stderr: bytes processed with ETA, calls in flight, tokens/sec, errors and retries')
+    parser.add_argument('--metrics-file', help='Periodically write run counters to this Prometheus textfile (e.g. for the node exporter textfile collector)')
+    parser.add_argument('--metrics-interval', type=float, default=DEFAULT_METRICS_INTERVAL, help=f'Seconds between --metrics-file writes (default: {DEFAULT_METRICS_INTERVAL:g})')
     parser.add_argument('--send-empty', action='store_true', help='Send empty lines with as empty context with the prompt instead of just emitting them back to stdout; no effect if -S is set')
     parser.add_argument('--tc', action='store_true', help='Token count mode: count tokens instead of processing prompts')
     parser.add_argument('-n', '--max-inference-calls', type=int, default=None, help='Maximum number of API calls to make (default: None)')
@@ -299,6 +1102,19 @@ def main():
     parser.add_argument('-C', '--clipboard', action='store_true', help='Get the context from the clipboard. Works with -c for large inputs.')
     parser.add_argument('-t', '--temperature', type=float, help='Temperature for the model')
     parser.add_argument('-T', '--timeout', type=int, help='Timeout in seconds of individual model requests (default: 30)')
+    parser.add_argument('--cascade', help='Comma-separated models, cheapest first (e.g. gpt-4o-mini,gpt-4o); an item escalates to the next model on an empty answer, "False (reason)", a --cascade-validate mismatch, or output reaching --limit')
+    parser.add_argument('--cascade-validate', help='Regex a --cascade answer must match to be accepted')
+    parser.add_argument('--hedge', action='store_true', help='Hedge slow requests: send a duplicate when a call exceeds the observed latency quantile; first answer wins')
+    parser.add_argument('--hedge-quantile', type=float, default=0.95, help='Latency quantile after which a request is hedged (default: 0.95)')
+    parser.add_argument('--hedge-after', type=float, help='Seconds before hedging until enough latencies are observed (default: no hedging until then)')
+    parser.add_argument('--hedge-max-rate', type=float, default=0.1, help='Maximum fraction of requests that may be hedged (default: 0.1)')
+    parser.add_argument('--hedge-base-url', help='OpenAI-compatible base URL to send hedge requests to (default: the primary endpoint)')
+    parser.add_argument('--budget-tokens', type=int, help='Stop spending once this many input+output tokens are used; each call is checked against its worst case before it is sent')
+    parser.add_argument('--budget-usd', type=float, help='Stop spending at this cost in USD, priced per model (see CLLM_MODELS for prices of unlisted models)')
+    parser.add_argument('--budget-policy', choices=BUDGET_POLICIES, default='stop', help='When the budget cannot fit the next call: stop, switch to --budget-fallback-model (cheaper-model), or shrink the output limit (lower-limit) (default: stop)')
+    parser.add_argument('--budget-fallback-model', help='Cheaper model for --budget-policy cheaper-model (default: the first --cascade model)')
+    parser.add_argument('--budget-min-limit', type=int, default=DEFAULT_MIN_LIMIT, help=f'Smallest output limit --budget-policy lower-limit may use (default: {DEFAULT_MIN_LIMIT})')
+    parser.add_argument('--shard', help='Process only shard i of N (e.g. 2/8) of the input, for running one job across machines; writes position-tagged JSONL for `cllm merge`')
     parser.add_argument('-gcm', '--git-commit-message', action='store_true', help='Generate Git commit message')
     parser.add_argument('inline_prompt', nargs=argparse.REMAINDER, help='Unmatched arguments to be used as the prompt if -p is not provided')
     args = parser.parse_args()
@@ -332,10 +1148,39 @@ def main():
         parser.print_help()
         sys.exit(1)
 
+    if args.list_templates:
+        PromptLibrary().print_listing()
+        return
+
     if not args.prompt:
-        args.prompt = ' '.join(args.inline_prompt)
+        args.prompt = [' '.join(args.inline_prompt)]
+
+    if args.template:
+        if args.expand_prompt or args.x:
+            print("Error: --template prompts are already expanded; do not combine with -x/--expand-prompt", file=sys.stderr)
+            sys.exit(1)
+        library = PromptLibrary()
+        try:
+            templates = [library.get(spec).template for spec in args.template]
+        except KeyError as e:
+            print(f"Error: {e.args[0]}", file=sys.stderr)
+            sys.exit(1)
+        args.prompt = [prompt for prompt in args.prompt if prompt] + templates
 
-    if not args.prompt and not args.git_commit_message:
+    stages = None
+    if args.pipeline:
+        if any(args.prompt) or args.expand_prompt or args.x:
+            print("Error: pass either a prompt (or -x/--template) or --pipeline, not both", file=sys.stderr)
+            sys.exit(1)
+        try:
+            stages = load_pipeline_spec(args.pipeline)
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Error: invalid --pipeline: {e}", file=sys.stderr)
+            sys.exit(1)
+        args.prompt = [stage.prompt for stage in stages]
+        args.single_string_stdin = args.single_string_stdin or stages[0].single_string
+
+    if not any(args.prompt) and not args.git_commit_message:
         print("Error: no prompt provided", file=sys.stderr)
         parser.print_help()
         sys.exit(1)
@@ -352,6 +1197,16 @@ def main():
         print("Error: If -C is passed, stdin should not be used.", file=sys.stderr)
         sys.exit(1)
 
+    if args.shard:
+        try:
+            args.shard = parse_shard_spec(args.shard)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        if args.jsonl or args.output_dir:
+            print("Error: --shard always writes JSONL for `cllm merge`; pass --jsonl/--output-dir to `cllm merge` instead", file=sys.stderr)
+            sys.exit(1)
+
     if args.temperature is not None:
         try:
             args.temperature = float(args.temperature)
@@ -364,6 +1219,21 @@ def main():
         if env_base_url:
             args.base_url = env_base_url
 
+    if args.cascade:
+        args.cascade = [model.strip() for model in args.cascade.split(',') if model.strip()]
+        if len(args.cascade) < 2 or args.model:
+            print("Error: --cascade takes at least two comma-separated models and replaces -m", file=sys.stderr)
+            sys.exit(1)
+        # One-off calls (-gcm, prompt expansion) use the strongest model
+        args.model = args.cascade[-1]
+
+    if args.cascade_validate:
+        try:
+            re.compile(args.cascade_validate)
+        except re.error as e:
+            print(f"Error: invalid --cascade-validate regex: {e}", file=sys.stderr)
+            sys.exit(1)
+
     if not args.model:
         if args.base_url:
             args.model = 'model'
@@ -376,6 +1246,34 @@ def main():
         else:
             args.limit = None  # Let the API decide for o1 models
 
+    if args.budget_policy == 'cheaper-model' and not args.budget_fallback_model and args.cascade:
+        args.budget_fallback_model = args.cascade[0]
+
+    if args.budget_tokens is not None or args.budget_usd is not None:
+        if args.hedge:
+            # A hedge duplicates a call after it was checked against the budget
+            print("Error: --hedge cannot be combined with --budget-tokens/--budget-usd", file=sys.stderr)
+            sys.exit(1)
+        if args.git_commit_message or args.expand_prompt or args.x:
+            # These calls run before the input is read and are not sized or counted against the budget
+            print("Error: -gcm and -x/--expand-prompt cannot be combined with --budget-tokens/--budget-usd", file=sys.stderr)
+            sys.exit(1)
+        if (args.budget_tokens is not None and args.budget_tokens <= 0) or (args.budget_usd is not None and args.budget_usd <= 0):
+            print("Error: --budget-tokens and --budget-usd must be positive", file=sys.stderr)
+            sys.exit(1)
+        if args.budget_policy == 'cheaper-model' and not args.budget_fallback_model:
+            print("Error: --budget-policy cheaper-model needs --budget-fallback-model (or --cascade)", file=sys.stderr)
+            sys.exit(1)
+        if args.budget_usd is not None:
+            budget_models = set(args.cascade or [args.model])
+            budget_models.update(stage.model for stage in stages or [] if stage.model)
+            if args.budget_fallback_model:
+                budget_models.add(args.budget_fallback_model)
+            unpriced = sorted(model for model in budget_models if lookup_price(model) is None)
+            if unpriced:
+                print(f"Error: no price for {', '.join(unpriced)}; add input_price/output_price (USD per 1M tokens) to {MODELS_CONFIG_PATH}", file=sys.stderr)
+                sys.exit(1)
+
     extensions = args.extensions.split(',') if args.extensions else None
 
     # Determine API key and base URL
@@ -411,45 +1309,69 @@ def main():
             client = openai.OpenAI(api_key=api_key, **client_kwargs)
         configure_openai_http_client(client, disable_ssl_verification, args.verbose)
 
+    hedger = None
+    if args.hedge:
+        alternate = None
+        if args.hedge_base_url:
+            alternate = openai.OpenAI(
+                api_key=os.getenv('OPENAI_API_KEY') or 'NO_KEY_SUPPLIED',
+                base_url=args.hedge_base_url,
+                **client_kwargs,
+            )
+            configure_openai_http_client(alternate, disable_ssl_verification, args.verbose)
+        hedger = Hedger(args.hedge_quantile, args.hedge_max_rate, args.hedge_after)
+        client = HedgedClient(client, hedger, alternate)
+
+    model_info = lookup_model(args.model)
+    if args.tokenizer:
+        model_info = model_info._replace(tokenizer=args.tokenizer)
+    if args.context_window:
+        model_info = model_info._replace(context_window=args.context_window)
+    elif model_info.context_window is None and args.base_url:
+        model_info = model_info._replace(context_window=query_server_context_window(client, args.model))
+    if args.cascade and not args.context_window:
+        # Chunks must fit every model in the cascade
+        windows = [lookup_model(model).context_window for model in args.cascade]
+        if all(windows):
+            model_info = model_info._replace(context_window=min(windows))
+    encoder, exact_tokenizer = resolve_encoder(args.model, model_info, args.verbose)
+
+    def sized_context_length(template: str, limit: Optional[int]) -> int:
+        """Honor -c if given, else fill the model's context window around the prompt and output limit."""
+        system_message = '' if 'o1' in args.model else (args.system or DEFAULT_SYSTEM)
+        length = args.context_length or auto_context_length(model_info.context_window, encoder, system_message, template, limit)
+        if not exact_tokenizer:
+            length = int(length * FALLBACK_CONTEXT_FACTOR)
+        return length
+
     if args.git_commit_message:
-        gcm_feature(args, client)
-    elif args.expand_prompt:
-        expand_prompt = args.expand_prompt or (
-            "Act as an elite prompt engineer working on an important project. The user is about to call an LLM in a bash pipeline, "
-            "using the LLM as a super-sophisticated sed/awk/etc, but with high-intelligence transformation. You must expand the simple "
-            "prompt to a fully fleshed-out prompt. Your prompt MUST include instructions to the LLM to be mindful of this circumstance "
-            "(bash pipeline) and instruct it to not output backticks or any such thing. You may see tokens in the prompt such as "
-            "{{context}} or {{filename}}; your prompt should use those verbatim; after your prompt is returned, when we call the LLM with "
-            "it, those strings will be substituted. Ensure the LLM understands it must avoid any extraneous output; no backticks, no "
-            "extemporaneous discussion. If the request is unfulfillable and the LLM believes it cannot properly produce a reply, it should "
-            "return the string 'False ({{failure_reason}})' where failure_reason is its reason; it should understand that will go to stderr "
-            "and the original input will go to stdout to attempt to cause a minimal disruption. "
-            "Tell the LLM to use newlines judiciously; we will neither add nor remove them; it should output them typically if a newline is "
-            "part of the input, but if the user is instructing it to, say, concatenate multiple lines in a way then it may not want to "
-            "put a newline in the output. "
-            "Additionally, if the user prompt does not contain the slug '{{context}}' then there is nowhere for the user input to go; which "
-            "means you must tell the model to ADD the '{{context}}' slug at the end, so that when we format the stdin input it is inserted. "
-            "You must now craft the prompt with these requirements in mind. Both you and the LLM should take a deep breath, think step by step, "
-            "output the most optimal output, being very mindful of the VERY STRICT requirements. If you and the LLM both are successful, you will "
-            "save lives. If you fail, innocent people may suffer grievous harm, so it is critical for you to succeed, and for the LLM to succeed, and you should "
-            "do your absolute best. Here is the prompt, with a single space after the colon and no other formatting: {prompt}"
-        )
-        expanded_prompt, _ = call_openai_api(client, args.model, expand_prompt.format(prompt=args.prompt), args.system, args.limit, args.temperature, args.verbose)
-        args.prompt = expanded_prompt
+        gcm_feature(args, client, encoder, sized_context_length('', None))
+    elif args.expand_prompt or args.x:
+        args.prompt = expand_prompts(client, args, PromptLibrary())
 
+    args.context_length = sized_context_length(max(args.prompt, key=len), args.limit)
+
+    # Placeholders are parsed and validated once here, not on every item
     try:
-        encoder = tiktoken.encoding_for_model(args.model)
-    except Exception as e:
-        # Only print the warning if verbose mode is enabled
-        if args.verbose:
-            print(f"Tokenizer for splits: could not load tokenizer for model {args.model} so using gpt-4; reducing context length by 5% to prevent overflows", file=sys.stderr)
-        encoder = tiktoken.encoding_for_model('gpt-4')
-        args.context_length = int(args.context_length * 0.95)
+        compiled_prompts = [compile_prompt(prompt) for prompt in args.prompt]
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
-    total_api_time = 0.0
-    total_input_tokens = 0
-    total_output_tokens = 0
-    total_api_calls = 0
+    args.budget = None
+    if args.budget_tokens is not None or args.budget_usd is not None:
+        system_message = '' if 'o1' in args.model else (args.system or DEFAULT_SYSTEM)
+        args.budget = Budget(
+            args.budget_tokens,
+            args.budget_usd,
+            args.budget_policy,
+            args.budget_fallback_model,
+            args.budget_min_limit,
+            overhead_tokens=count_tokens(system_message, encoder) + MESSAGE_OVERHEAD_TOKENS,
+            input_factor=1.0 if exact_tokenizer else 1 / FALLBACK_CONTEXT_FACTOR,
+        )
+
+    stats = Stats()
 
     if args.verbose:
         print(f"directory is {args.directory}", file=sys.stderr)
@@ -460,167 +1382,38 @@ def main():
         print(f"token_count_mode is {args.tc}", file=sys.stderr)
         print(f"model is {args.model}", file=sys.stderr)
         print(f"timeout is {args.timeout}", file=sys.stderr)
+        print(f"prompts: {len(args.prompt)}", file=sys.stderr)
+        print(f"shard is {args.shard}", file=sys.stderr)
 
-    if args.directory:
-        gitignore_map = load_gitignore_files(args.directory)
-        for file_path, start_line, chunk in process_files(
-            directory=args.directory,
-            context_length=args.context_length,
-            extensions=extensions,
-            file_filter=args.filter,
-            verbose=args.verbose,
-            token_count_mode=args.tc,
-            encoder=encoder,
-            gitignore_map=gitignore_map
-        ):
-            if args.verbose:
-                print(f"Input Processing: file_path: {file_path}, start_line: {start_line}, chunk: {chunk}", file=sys.stderr)
-            if '{context}' not in args.prompt:
-                args.prompt += ' | Context: {context}'
-            prompt = args.prompt.format(filename=file_path, startline=start_line, context=chunk)
-            response, elapsed_time = call_openai_api(client, args.model, prompt, args.system, args.limit, args.temperature, args.verbose)
-            total_api_time += elapsed_time
-            total_input_tokens += count_tokens(prompt, encoder)
-            total_output_tokens += count_tokens(response, encoder)
-            total_api_calls += 1
-            print(response)
-            if args.max_inference_calls and total_api_calls >= args.max_inference_calls:
-                break
-    else:
-        if args.clipboard:
-            context = pyperclip.paste()
-            if '{context}' not in args.prompt and context.strip():
-                args.prompt += ' | Context: {context}'
-            
-            # New code to handle large clipboard content
-            tokenized_context = encoder.encode(context)
-            while tokenized_context:
-                if len(tokenized_context) > args.context_length:
-                    split_point = args.context_length
-                    while split_point > 0 and tokenized_context[split_point] != ord(' '):
-                        split_point -= 1
-                    if split_point == 0:
-                        split_point = args.context_length
-                    chunk_to_send = encoder.decode(tokenized_context[:split_point])
-                    tokenized_context = tokenized_context[split_point:]
-                else:
-                    chunk_to_send = encoder.decode(tokenized_context)
-                    tokenized_context = []
-                
-                prompt = args.prompt.format(context=chunk_to_send.strip())
-                response, elapsed_time = call_openai_api(client, args.model, prompt, args.system, args.limit, args.temperature, args.verbose)
-                total_api_time += elapsed_time
-                total_input_tokens += count_tokens(prompt, encoder)
-                total_output_tokens += count_tokens(response, encoder)
-                total_api_calls += 1
-                print(response)
-                
-                if args.max_inference_calls and total_api_calls >= args.max_inference_calls:
-                    break
-        
-        elif sys.stdin.isatty():
-            try:
-                rlist, _, _ = select.select([sys.stdin], [], [], 0.1)
-                if rlist:
-                    stdin_content = sys.stdin.read()
-                    if args.single_string_stdin:
-                        if '{context}' not in args.prompt and stdin_content.strip():
-                            args.prompt += ' | Context: {context}'
-                        prompt = args.prompt.format(context=stdin_content.strip())
-                        response, elapsed_time = call_openai_api(client, args.model, prompt, args.system, args.limit, args.temperature, args.verbose)
-                        total_api_time += elapsed_time
-                        total_input_tokens += count_tokens(prompt, encoder)
-                        total_output_tokens += count_tokens(response, encoder)
-                        total_api_calls += 1
-                        print(response)
-                    else:
-                        for line in stdin_content.splitlines():
-                            if '{context}' not in args.prompt and line.strip():
-                                args.prompt += ' | Context: {context}'
-                            prompt = args.prompt.format(context=line.strip())
-                            response, elapsed_time = call_openai_api(client, args.model, prompt, args.system, args.limit, args.temperature, args.verbose)
-                            total_api_time += elapsed_time
-                            total_input_tokens += count_tokens(prompt, encoder)
-                            total_output_tokens += count_tokens(response, encoder)
-                            total_api_calls += 1
-                            print(response)
-                            if args.max_inference_calls and total_api_calls >= args.max_inference_calls:
-                                break
-                else:
-                    context = ''
-                    prompt = args.prompt.format(context=context)
-                    response, elapsed_time = call_openai_api(client, args.model, prompt, args.system, args.limit, args.temperature, args.verbose)
-                    total_api_time += elapsed_time
-                    total_input_tokens += count_tokens(prompt, encoder)
-                    total_output_tokens += count_tokens(response, encoder)
-                    total_api_calls += 1
-                    print(response)
-            except select.error:
-                context = ''
-                prompt = args.prompt.format(context=context)
-                response, elapsed_time = call_openai_api(client, args.model, prompt, args.system, args.limit, args.temperature, args.verbose)
-                total_api_time += elapsed_time
-                total_input_tokens += count_tokens(prompt, encoder)
-                total_output_tokens += count_tokens(response, encoder)
-                total_api_calls += 1
-                print(response)
-        else:
-            # Blocking read from pipe
-            stdin_content = sys.stdin.read()
-            if args.single_string_stdin:
-                if '{context}' not in args.prompt and stdin_content.strip():
-                    args.prompt += ' | Context: {context}'
-                context = stdin_content.strip()
-                while context:
-                    # Tokenize the context to ensure it doesn't exceed the context length
-                    tokenized_context = encoder.encode(context)
-                    if len(tokenized_context) > args.context_length:
-                        split_point = args.context_length
-                        while split_point > 0 and tokenized_context[split_point] != ' ':
-                            split_point -= 1
-                        if split_point == 0:
-                            split_point = args.context_length
-                        chunk_to_send = encoder.decode(tokenized_context[:split_point])
-                        remaining = encoder.decode(tokenized_context[split_point:])
-                    else:
-                        chunk_to_send = context
-                        remaining = ''
-                    
-                    prompt = args.prompt.format(context=chunk_to_send)
-                    response, elapsed_time = call_openai_api(client, args.model, prompt, args.system, args.limit, args.temperature, args.verbose)
-                    total_api_time += elapsed_time
-                    total_input_tokens += count_tokens(prompt, encoder)
-                    total_output_tokens += count_tokens(response, encoder)
-                    total_api_calls += 1
-                    print(response)
-                    context = remaining
-                    if args.max_inference_calls and total_api_calls >= args.max_inference_calls:
-                        break
+    exhausted = None
+    with Telemetry(stats, args.progress_bar, args.metrics_file, args.metrics_interval, hedger):
+        items = iter_work_items(args, encoder, extensions, stats)
+        shard_writer = ShardWriter(args.shard, len(args.prompt), bool(stages)) if args.shard else None
+        try:
+            if stages:
+                run_pipeline(client, args, stages, compiled_prompts, items, encoder, stats, shard_writer)
             else:
-                for line in stdin_content.splitlines():
-                    if not args.send_empty and not line.strip():
-                        print("")
-                        continue
-                    if '{context}' not in args.prompt and line.strip():
-                        args.prompt += ' | Context: {context}'
-                    prompt = args.prompt.format(context=line.strip())
-                    response, elapsed_time = call_openai_api(client, args.model, prompt, args.system, args.limit, args.temperature, args.verbose)
-                    total_api_time += elapsed_time
-                    total_input_tokens += count_tokens(prompt, encoder)
-                    total_output_tokens += count_tokens(response, encoder)
-                    total_api_calls += 1
-                    print(response)
-                    if args.max_inference_calls and total_api_calls >= args.max_inference_calls:
-                        break
+                writer = shard_writer or OutputWriter(len(args.prompt), args.jsonl, args.output_dir)
+                try:
+                    run_prompts(client, args, compiled_prompts, items, encoder, stats, writer)
+                finally:
+                    writer.close()
+        except BudgetExhausted as e:
+            # Everything completed so far has been written; stop cleanly
+            exhausted = e
+
+    if exhausted:
+        report_budget_exhausted(exhausted, stats)
 
     if args.stats:
-        print("\n---- Stats ----", file=sys.stderr)
-        print(f"Total execution time (API calls): {total_api_time:.2f} seconds", file=sys.stderr)
-        print(f"Total input tokens: {total_input_tokens}", file=sys.stderr)
-        print(f"Total output tokens: {total_output_tokens}", file=sys.stderr)
-        print(f"Input tokens/sec: {total_input_tokens / total_api_time:.2f}", file=sys.stderr)
-        print(f"Output tokens/sec: {total_output_tokens / total_api_time:.2f}", file=sys.stderr)
-        print(f"Total API calls made: {total_api_calls}", file=sys.stderr)
+        stats.print()
+        if hedger:
+            hedger.print_stats()
+        if args.budget:
+            args.budget.print_stats()
+
+    if exhausted:
+        sys.exit(EXIT_BUDGET_EXHAUSTED)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,205 @@
+# cllm model registry: maps model names to tokenizers and context windows
+
+# (c) Copyright Matthew Wallace 2024; Licensed under Apache-2.0 Text version: https://www.apache.org/licenses/LICENSE-2.0.txt (see LICENSE)
+
+import os
+import sys
+import json
+from typing import Dict, List, NamedTuple, Optional
+
+import tiktoken
+
+
+class ModelInfo(NamedTuple):
+    """Tokenizer (tiktoken encoding name or tokenizer.json path) and context window in tokens."""
+    tokenizer: Optional[str]
+    context_window: Optional[int]
+
+
+# Matched by longest prefix of the lowercased model name; Azure deployment
+# names that follow the model name (e.g. "gpt-4o-2024-08-06") match too.
+MODEL_REGISTRY: Dict[str, ModelInfo] = {
+    'gpt-4.1': ModelInfo('o200k_base', 1047576),
+    'gpt-4o': ModelInfo('o200k_base', 128000),
+    'chatgpt-4o': ModelInfo('o200k_base', 128000),
+    'o1-preview': ModelInfo('o200k_base', 128000),
+    'o1-mini': ModelInfo('o200k_base', 128000),
+    'o1': ModelInfo('o200k_base', 200000),
+    'o3': ModelInfo('o200k_base', 200000),
+    'o4-mini': ModelInfo('o200k_base', 200000),
+    'gpt-4-turbo': ModelInfo('cl100k_base', 128000),
+    'gpt-4-1106': ModelInfo('cl100k_base', 128000),
+    'gpt-4-0125': ModelInfo('cl100k_base', 128000),
+    'gpt-4-32k': ModelInfo('cl100k_base', 32768),
+    'gpt-4': ModelInfo('cl100k_base', 8192),
+    'gpt-3.5-turbo-instruct': ModelInfo('cl100k_base', 4096),
+    'gpt-3.5-turbo': ModelInfo('cl100k_base', 16385),
+    'gpt-35-turbo': ModelInfo('cl100k_base', 16385),
+}
+
+
+
+class ModelPrice(NamedTuple):
+    """List price in USD per million input and output tokens."""
+    input: float
+    output: float
+
+
+# Prices for --budget-usd, matched like MODEL_REGISTRY. These are list prices at
+# the time of writing; add "input_price"/"output_price" to the models config for
+# other models or negotiated rates.
+MODEL_PRICES: Dict[str, ModelPrice] = {
+    'gpt-4.1-nano': ModelPrice(0.10, 0.40),
+    'gpt-4.1-mini': ModelPrice(0.40, 1.60),
+    'gpt-4.1': ModelPrice(2.00, 8.00),
+    'gpt-4o-mini': ModelPrice(0.15, 0.60),
+    'gpt-4o': ModelPrice(2.50, 10.00),
+    'chatgpt-4o': ModelPrice(5.00, 15.00),
+    'o1-preview': ModelPrice(15.00, 60.00),
+    'o1-mini': ModelPrice(1.10, 4.40),
+    'o1': ModelPrice(15.00, 60.00),
+    'o3-mini': ModelPrice(1.10, 4.40),
+    'o3': ModelPrice(2.00, 8.00),
+    'o4-mini': ModelPrice(1.10, 4.40),
+    'gpt-4-turbo': ModelPrice(10.00, 30.00),
+    'gpt-4-1106': ModelPrice(10.00, 30.00),
+    'gpt-4-0125': ModelPrice(10.00, 30.00),
+    'gpt-4-32k': ModelPrice(60.00, 120.00),
+    'gpt-4': ModelPrice(30.00, 60.00),
+    'gpt-3.5-turbo-instruct': ModelPrice(1.50, 2.00),
+    'gpt-3.5-turbo': ModelPrice(0.50, 1.50),
+    'gpt-35-turbo': ModelPrice(0.50, 1.50),
+}
+
+# User overrides, e.g. for local models served behind -B:
+#   {"model": {"tokenizer": "~/models/llama3/tokenizer.json", "context_window": 8192,
+#              "input_price": 0.0, "output_price": 0.0}}
+MODELS_CONFIG_PATH = os.path.expanduser(os.getenv('CLLM_MODELS', '~/.config/cllm/models.json'))
+
+FALLBACK_TOKENIZER = 'cl100k_base'
+# Safety factor applied to chunk sizes when counting with the fallback tokenizer
+FALLBACK_CONTEXT_FACTOR = 0.95
+DEFAULT_CONTEXT_LENGTH = 4096
+# Chat framing (role markers etc.) not visible in the message text
+MESSAGE_OVERHEAD_TOKENS = 16
+# Output reserve for models run without -l (e.g. o1, where limit defaults to none)
+UNLIMITED_OUTPUT_RESERVE = 16384
+
+
+class HFTokenizerEncoder:
+    """Adapt a Hugging Face tokenizers.Tokenizer to the tiktoken encode/decode interface."""
+
+    def __init__(self, path: str):
+        try:
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError("the 'tokenizers' package is required to load tokenizer.json files (pip install tokenizers)")
+        self.name = path
+        self._tokenizer = Tokenizer.from_file(path)
+
+    def encode(self, text: str) -> List[int]:
+        """Token ids of text, without special tokens."""
+        return self._tokenizer.encode(text, add_special_tokens=False).ids
+
+    def decode(self, tokens: List[int]) -> str:
+        """Text of a list of token ids."""
+        return self._tokenizer.decode(list(tokens))
+
+
+def load_models_config(path: str = MODELS_CONFIG_PATH) -> dict:
+    """Load the raw user models config, keyed by lowercased model name; empty if absent or unreadable."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring model config {path}: {e}", file=sys.stderr)
+        return {}
+    return {name.lower(): entry for name, entry in entries.items()}
+
+
+def load_user_models(path: str = MODELS_CONFIG_PATH) -> Dict[str, ModelInfo]:
+    """Load user model overrides from the JSON config, if present."""
+    return {
+        name: ModelInfo(entry.get('tokenizer'), entry.get('context_window'))
+        for name, entry in load_models_config(path).items()
+    }
+
+
+def load_user_prices(path: str = MODELS_CONFIG_PATH) -> Dict[str, ModelPrice]:
+    """Load user prices from the JSON config entries that set both input_price and output_price."""
+    return {
+        name: ModelPrice(float(entry['input_price']), float(entry['output_price']))
+        for name, entry in load_models_config(path).items()
+        if entry.get('input_price') is not None and entry.get('output_price') is not None
+    }
+
+
+def _match(name: str, registries):
+    """Look a lowercased model name up in registries: exact names first, then the longest prefix."""
+    if name in registries[0]:
+        return registries[0][name]
+    for registry in registries:
+        matches = [prefix for prefix in registry if name.startswith(prefix)]
+        if matches:
+            return registry[max(matches, key=len)]
+    return None
+
+
+def lookup_model(model: str, user_models: Optional[Dict[str, ModelInfo]] = None) -> ModelInfo:
+    """Return the registry entry for a model; user entries win, exact names before prefixes."""
+    user_models = load_user_models() if user_models is None else user_models
+    return _match(model.lower(), (user_models, MODEL_REGISTRY)) or ModelInfo(None, None)
+
+
+def lookup_price(model: str, user_prices: Optional[Dict[str, ModelPrice]] = None) -> Optional[ModelPrice]:
+    """Return the price of a model, or None if unknown; user entries win, exact names before prefixes."""
+    user_prices = load_user_prices() if user_prices is None else user_prices
+    return _match(model.lower(), (user_prices, MODEL_PRICES))
+
+
+def load_encoder(tokenizer: str):
+    """Load a tokenizer by tiktoken encoding name or tokenizer.json path."""
+    path = os.path.expanduser(tokenizer)
+    if path.endswith('.json') or os.path.isfile(path):
+        return HFTokenizerEncoder(path)
+    return tiktoken.get_encoding(tokenizer)
+
+
+def resolve_encoder(model: str, info: ModelInfo, verbose: bool = False):
+    """Return (encoder, exact) for the model; exact is False when falling back to an approximate tokenizer."""
+    if info.tokenizer:
+        try:
+            return load_encoder(info.tokenizer), True
+        except Exception as e:
+            print(f"Warning: could not load tokenizer {info.tokenizer} for model {model}: {e}", file=sys.stderr)
+    try:
+        return tiktoken.encoding_for_model(model), True
+    except Exception:
+        if verbose:
+            print(f"Tokenizer for splits: no tokenizer registered for model {model}; using {FALLBACK_TOKENIZER}; reducing context length by 5% to prevent overflows", file=sys.stderr)
+        return tiktoken.get_encoding(FALLBACK_TOKENIZER), False
+
+
+def query_server_context_window(client, model: str) -> Optional[int]:
+    """Ask an OpenAI-compatible server (vLLM, llama.cpp, ...) for the served model's context window."""
+    try:
+        models = client.models.list()
+    except Exception:
+        return None
+    for entry in getattr(models, 'data', []):
+        extra = getattr(entry, 'model_extra', None) or {}
+        window = extra.get('max_model_len') or extra.get('context_length') or extra.get('n_ctx')
+        if window and (entry.id == model or len(models.data) == 1):
+            return int(window)
+    return None
+
+
+def auto_context_length(context_window: Optional[int], encoder, system_message: str, template: str, limit: Optional[int]) -> int:
+    """Size input chunks as the context window minus system prompt, template and output limit."""
+    if not context_window:
+        return DEFAULT_CONTEXT_LENGTH
+    reserve = limit if limit is not None else min(UNLIMITED_OUTPUT_RESERVE, context_window // 4)
+    used = len(encoder.encode(system_message or '')) + len(encoder.encode(template or '')) + reserve + MESSAGE_OVERHEAD_TOKENS
+    return max(context_window - used, 1)
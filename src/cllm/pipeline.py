@@ -0,0 +1,191 @@
+# cllm pipelines: run `cllm A | cllm B | cllm C` style stages inside one process
+
+# (c) Copyright Matthew Wallace 2024; Licensed under Apache-2.0 Text version: https://www.apache.org/licenses/LICENSE-2.0.txt (see LICENSE)
+
+import os
+import json
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+DEFAULT_STAGE_CONCURRENCY = 4
+
+
+class Stage(NamedTuple):
+    """One pipeline stage; unset options fall back to the command-line values."""
+    prompt: str
+    model: Optional[str] = None
+    system: Optional[str] = None
+    limit: Optional[int] = None
+    temperature: Optional[float] = None
+    concurrency: int = DEFAULT_STAGE_CONCURRENCY
+    single_string: bool = False  # take the previous stage's whole output as one item instead of per line
+
+
+def load_pipeline_spec(spec: str) -> List[Stage]:
+    """Load stages from a JSON file path or inline JSON: a list of stage objects or {"stages": [...]}."""
+    if os.path.exists(spec):
+        with open(spec, 'r') as f:
+            data = json.load(f)
+    else:
+        data = json.loads(spec)
+    if isinstance(data, dict):
+        data = data.get('stages', [])
+    if not data:
+        raise ValueError("pipeline has no stages")
+
+    stages = []
+    for i, entry in enumerate(data):
+        if isinstance(entry, str):
+            entry = {'prompt': entry}
+        unknown = set(entry) - set(Stage._fields)
+        if unknown:
+            raise ValueError(f"stage {i + 1}: unknown option(s) {', '.join(sorted(unknown))}")
+        if not entry.get('prompt'):
+            raise ValueError(f"stage {i + 1}: missing prompt")
+        stage = Stage(**entry)
+        if stage.concurrency < 1:
+            raise ValueError(f"stage {i + 1}: concurrency must be at least 1")
+        stages.append(stage)
+    return stages
+
+
+def gather(futures: List[Future]) -> Future:
+    """Return a future for the concatenated list results of futures, in order."""
+    combined = Future()
+    if not futures:
+        combined.set_result([])
+        return combined
+    lock = threading.Lock()
+    remaining = [len(futures)]
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        for future in futures:
+            if future.exception() is not None:
+                combined.set_exception(future.exception())
+                return
+        combined.set_result([line for future in futures for line in future.result()])
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+class PipelineRunner:
+    """Stream items through stages, each with its own thread pool, preserving input order in the output.
+
+    call_stage(stage, context, origin) performs one API call for a stage; the
+    client and encoder behind it are shared by every stage.
+    """
+
+    def __init__(self, stages: List[Stage], call_stage: Callable[[Stage, str, object], str], send_empty: bool = False):
+        self.stages = stages
+        self.call_stage = call_stage
+        self.send_empty = send_empty
+        self.executors = [
+            ThreadPoolExecutor(max_workers=stage.concurrency, thread_name_prefix=f"cllm-stage{i + 1}")
+            for i, stage in enumerate(stages)
+        ]
+
+    def submit(self, context: str, origin=None, stage_index: int = 0) -> Future:
+        """Run context through stages[stage_index:], resolving to the final output lines.
+
+        origin is passed unchanged to call_stage for every stage, e.g. the input
+        item the context was derived from.
+        """
+        result = Future()
+        stage = self.stages[stage_index]
+        call_future = self.executors[stage_index].submit(self.call_stage, stage, context, origin)
+
+        def on_done(f):
+            try:
+                response = f.result()
+            except BaseException as e:
+                result.set_exception(e)
+                return
+            if stage_index + 1 == len(self.stages):
+                result.set_result([response])
+                return
+            children = []
+            try:
+                for next_context in self._next_contexts(response, stage_index + 1):
+                    if next_context is None:
+                        children.append(self._done([""]))
+                    else:
+                        children.append(self.submit(next_context, origin, stage_index + 1))
+            except RuntimeError as e:
+                # Executors already shut down after an earlier failure
+                result.set_exception(e)
+                return
+            gather(children).add_done_callback(lambda g: self._copy(g, result))
+
+        call_future.add_done_callback(on_done)
+        return result
+
+    def _next_contexts(self, response: str, stage_index: int) -> List[Optional[str]]:
+        """Split a response into the next stage's items; None marks an empty line passed straight through."""
+        if self.stages[stage_index].single_string:
+            return [response.strip()]
+        return [
+            line.strip() if self.send_empty or line.strip() else None
+            for line in response.splitlines()
+        ]
+
+    @staticmethod
+    def _done(value) -> Future:
+        future = Future()
+        future.set_result(value)
+        return future
+
+    @staticmethod
+    def _copy(source: Future, target: Future) -> None:
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
+    def run(self, inputs: Iterable[Tuple[Optional[str], object]], write: Callable[[str], None], should_stop: Callable[[], bool] = lambda: False, on_item_done: Optional[Callable[[object], None]] = None) -> None:
+        """Feed (context, origin) pairs and write final lines in input order as they complete.
+
+        A context of None is an empty line passed straight through to the output.
+        on_item_done(origin) is called once an item's output has been written.
+        """
+        window = 2 * sum(stage.concurrency for stage in self.stages)
+        pending: "queue.Queue[Optional[Tuple[Future, object]]]" = queue.Queue(maxsize=window)
+        errors = []
+
+        def writer():
+            while True:
+                entry = pending.get()
+                if entry is None:
+                    return
+                if errors:
+                    continue  # drain so the feeder never blocks
+                future, origin = entry
+                try:
+                    for line in future.result():
+                        write(line)
+                    if on_item_done:
+                        on_item_done(origin)
+                except BaseException as e:
+                    errors.append(e)
+
+        writer_thread = threading.Thread(target=writer, name="cllm-pipeline-writer", daemon=True)
+        writer_thread.start()
+        try:
+            for context, origin in inputs:
+                if errors or should_stop():
+                    break
+                pending.put((self._done([""]) if context is None else self.submit(context, origin), origin))
+        finally:
+            pending.put(None)
+            writer_thread.join()
+            for executor in self.executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+        if errors:
+            raise errors[0]
@@ -0,0 +1,160 @@
+# cllm prompt templates: compile-once placeholders and a local library of expanded prompts
+
+# (c) Copyright Matthew Wallace 2024; Licensed under Apache-2.0 Text version: https://www.apache.org/licenses/LICENSE-2.0.txt (see LICENSE)
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+from string import Formatter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+PLACEHOLDERS = ('context', 'filename', 'startline')
+CONTEXT_SUFFIX = ' | Context: {context}'
+
+PROMPT_LIBRARY_PATH = os.path.expanduser(os.getenv('CLLM_PROMPTS', '~/.config/cllm/prompts.json'))
+
+_formatter = Formatter()
+
+
+class CompiledPrompt(NamedTuple):
+    """A prompt template parsed once into literal text and placeholder fields."""
+    template: str
+    segments: Tuple[Tuple[str, Optional[str], str, Optional[str]], ...]  # (literal, field, format_spec, conversion)
+    has_context: bool
+
+    def render(self, context: str, filename: Optional[str] = None, startline: Optional[int] = None) -> str:
+        """Fill the template; like the old .format path, a template without {context} gets one appended for non-empty context."""
+        values = {'context': context, 'filename': filename, 'startline': startline}
+        parts = []
+        for literal, field, format_spec, conversion in self.segments:
+            parts.append(literal)
+            if field is not None:
+                value = _formatter.convert_field(values[field], conversion)
+                parts.append(format(value, format_spec))
+        if not self.has_context and context.strip():
+            parts.append(CONTEXT_SUFFIX.format(context=context))
+        return ''.join(parts)
+
+
+def escape_unknown_placeholders(template: str) -> str:
+    """Double the braces of anything that is not a known placeholder, e.g. JSON in an LLM-written prompt."""
+    known = '|'.join(PLACEHOLDERS)
+    pattern = re.compile(r'\{\{|\}\}|\{(?:' + known + r')(?:![rsa])?(?::[^{}]*)?\}|[{}]')
+
+    def replace(match):
+        token = match.group(0)
+        if token in ('{', '}'):
+            return token * 2
+        return token
+
+    return pattern.sub(replace, template)
+
+
+def compile_prompt(template: str, escape_unknown: bool = False) -> CompiledPrompt:
+    """Parse and validate a template's placeholders once; raises ValueError on unknown or malformed ones."""
+    if escape_unknown:
+        template = escape_unknown_placeholders(template)
+    try:
+        parsed = list(_formatter.parse(template))
+    except ValueError as e:
+        raise ValueError(f"malformed placeholder in prompt ({e}); use {{{{ and }}}} for literal braces")
+
+    segments = []
+    for literal, field, format_spec, conversion in parsed:
+        if field is not None and field not in PLACEHOLDERS:
+            raise ValueError(
+                f"unknown placeholder {{{field}}} in prompt; supported: "
+                + ', '.join('{' + name + '}' for name in PLACEHOLDERS)
+                + "; use {{ and }} for literal braces"
+            )
+        segments.append((literal, field, format_spec or '', conversion))
+    has_context = any(field == 'context' for _, field, _, _ in segments)
+    return CompiledPrompt(template, tuple(segments), has_context)
+
+
+class LibraryEntry(NamedTuple):
+    """One version of a named template in the prompt library."""
+    name: str
+    version: int
+    template: str
+    source_prompt: str
+    expansion_key: str
+    model: str
+    created: float
+
+
+def expansion_key(source_prompt: str, expansion_prompt: str, model: str) -> str:
+    """Key an expansion by everything that determines it: the user prompt, the expansion prompt and the model."""
+    payload = json.dumps([source_prompt, expansion_prompt, model])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PromptLibrary:
+    """Named, versioned templates stored as JSON, e.g. the results of -x/--expand-prompt."""
+
+    def __init__(self, path: str = PROMPT_LIBRARY_PATH):
+        self.path = path
+        self.templates: Dict[str, List[LibraryEntry]] = {}
+        self.dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                self.templates = {
+                    name: [LibraryEntry(**entry) for entry in versions]
+                    for name, versions in data.get('templates', {}).items()
+                }
+            except (OSError, ValueError, TypeError) as e:
+                print(f"Warning: ignoring unreadable prompt library {path}: {e}", file=sys.stderr)
+
+    def find(self, key: str) -> Optional[LibraryEntry]:
+        """Return the newest entry compiled from exactly this prompt, expansion prompt and model."""
+        matches = [entry for versions in self.templates.values() for entry in versions if entry.expansion_key == key]
+        return max(matches, key=lambda entry: entry.created) if matches else None
+
+    def get(self, spec: str) -> LibraryEntry:
+        """Look up 'name' (latest version) or 'name@version'; raises KeyError if absent."""
+        name, _, version = spec.partition('@')
+        versions = self.templates.get(name)
+        if not versions:
+            raise KeyError(f"no template named '{name}' in {self.path}")
+        if not version:
+            return versions[-1]
+        for entry in versions:
+            if str(entry.version) == version:
+                return entry
+        raise KeyError(f"template '{name}' has no version {version}")
+
+    def add(self, name: str, template: str, source_prompt: str, key: str, model: str) -> LibraryEntry:
+        """Store a compiled template as the next version of name, unless it is identical to the latest."""
+        versions = self.templates.setdefault(name, [])
+        if versions and versions[-1].template == template and versions[-1].expansion_key == key:
+            return versions[-1]
+        entry = LibraryEntry(name, len(versions) + 1, template, source_prompt, key, model, time.time())
+        versions.append(entry)
+        self.dirty = True
+        return entry
+
+    def save(self) -> None:
+        """Write the library back to its file if anything was added."""
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        data = {'templates': {name: [entry._asdict() for entry in versions] for name, versions in self.templates.items()}}
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except OSError as e:
+            print(f"Warning: unable to save prompt library {self.path}: {e}", file=sys.stderr)
+
+    def print_listing(self) -> None:
+        """Print the latest version of each template, for --list-templates."""
+        for name, versions in sorted(self.templates.items()):
+            latest = versions[-1]
+            print(f"{name}@{latest.version}\t{latest.model}\t{latest.source_prompt}")
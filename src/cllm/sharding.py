@@ -0,0 +1,124 @@
+# cllm sharding: split one job across machines with --shard i/N, then `cllm merge` the outputs
+
+# (c) Copyright Matthew Wallace 2024; Licensed under Apache-2.0 Text version: https://www.apache.org/licenses/LICENSE-2.0.txt (see LICENSE)
+
+import os
+import sys
+import json
+import hashlib
+from typing import List, NamedTuple, Optional, Tuple
+
+SHARD_HEADER_KEY = 'cllm_shard'
+
+
+class ShardSpec(NamedTuple):
+    """This worker's shard: index is 1-based, count is the total number of shards."""
+    index: int
+    count: int
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+
+def parse_shard_spec(spec: str) -> ShardSpec:
+    """Parse 'i/N' with 1 <= i <= N; raises ValueError otherwise."""
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"--shard must look like i/N (e.g. 2/8), got '{spec}'")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"--shard {spec}: need 1 <= i <= N")
+    return ShardSpec(index, count)
+
+
+def stable_hash(key: str) -> int:
+    """A hash that is the same on every machine and Python process, unlike hash()."""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def assign_files(files_and_sizes: List[Tuple[str, int]], directory: str, shard_count: int) -> List[int]:
+    """Return a 1-based shard per file, balancing total bytes across shards.
+
+    Largest files are placed first, each on the least-loaded shard; ties in size
+    are ordered by a stable hash of the path relative to directory, so every
+    worker computes the same assignment from the same tree.
+    """
+    keys = [os.path.relpath(path, directory) for path, _ in files_and_sizes]
+    order = sorted(range(len(files_and_sizes)), key=lambda i: (-files_and_sizes[i][1], stable_hash(keys[i]), keys[i]))
+    loads = [0] * shard_count
+    assignment = [0] * len(files_and_sizes)
+    for i in order:
+        shard = min(range(shard_count), key=lambda k: (loads[k], k))
+        assignment[i] = shard + 1
+        loads[shard] += files_and_sizes[i][1] + 1  # +1 so empty files spread out too
+    return assignment
+
+
+def shard_of_index(index: int, shard_count: int) -> int:
+    """1-based shard for a streamed item (stdin line or chunk) by its position in the input."""
+    return stable_hash(str(index)) % shard_count + 1
+
+
+class ShardWriter:
+    """Write responses as JSONL records carrying each item's position, for `cllm merge`."""
+
+    def __init__(self, shard: ShardSpec, prompt_count: int, pipeline: bool = False, out=None):
+        self.out = out or sys.stdout
+        self.pending_lines: List[str] = []
+        header = {'index': shard.index, 'count': shard.count, 'prompts': prompt_count, 'pipeline': pipeline}
+        self._emit({SHARD_HEADER_KEY: header})
+
+    def _emit(self, record: dict) -> None:
+        print(json.dumps(record), file=self.out, flush=True)
+
+    def write(self, item, prompt_index: int, response: str) -> None:
+        """Emit one response tagged with its item's position and prompt."""
+        record = {'pos': list(item.position), 'prompt': prompt_index + 1, 'response': response}
+        if item.filename is not None:
+            record['filename'] = item.filename
+            record['startline'] = item.startline
+        self._emit(record)
+
+    def write_line(self, line: str) -> None:
+        """Buffer one pipeline output line until its item completes."""
+        self.pending_lines.append(line)
+
+    def item_done(self, item) -> None:
+        """Flush the buffered pipeline lines of a completed item."""
+        self._emit({'pos': list(item.position), 'lines': self.pending_lines})
+        self.pending_lines = []
+
+    def close(self) -> None:
+        """Nothing to flush; records are written as they arrive."""
+        pass
+
+
+def read_shard_outputs(paths: List[str]) -> Tuple[dict, List[dict]]:
+    """Read shard output files; return the common header and all records in single-node order."""
+    header: Optional[dict] = None
+    seen = set()
+    records = []
+    for path in paths:
+        with open(path, 'r') as f:
+            first = f.readline()
+            try:
+                shard_header = json.loads(first)[SHARD_HEADER_KEY]
+            except (ValueError, KeyError, TypeError):
+                raise ValueError(f"{path}: not a cllm --shard output (missing header)")
+            if header is None:
+                header = shard_header
+            elif (shard_header['count'], shard_header['prompts'], shard_header['pipeline']) != (header['count'], header['prompts'], header['pipeline']):
+                raise ValueError(f"{path}: shard {shard_header['index']}/{shard_header['count']} is from a different job")
+            if shard_header['index'] in seen:
+                raise ValueError(f"{path}: shard {shard_header['index']} given twice")
+            seen.add(shard_header['index'])
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    if header is None:
+        raise ValueError("no shard outputs given")
+    missing = sorted(set(range(1, header['count'] + 1)) - seen)
+    if missing:
+        print(f"Warning: missing shard(s) {', '.join(map(str, missing))} of {header['count']}; output is incomplete", file=sys.stderr)
+    records.sort(key=lambda record: (record['pos'], record.get('prompt', 0)))
+    return header, records
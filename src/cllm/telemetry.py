@@ -0,0 +1,128 @@
+# cllm live telemetry: -b progress bar and Prometheus textfile export
+
+# (c) Copyright Matthew Wallace 2024; Licensed under Apache-2.0 Text version: https://www.apache.org/licenses/LICENSE-2.0.txt (see LICENSE)
+
+import os
+import sys
+import time
+import threading
+from typing import Optional
+
+from tqdm import tqdm
+
+PROGRESS_REFRESH_SECONDS = 0.5
+DEFAULT_METRICS_INTERVAL = 10.0
+
+
+class Telemetry:
+    """Periodically render run counters to a stderr progress bar and/or a Prometheus textfile.
+
+    Counters are read from the run's Stats (and the Hedger, if hedging); nothing
+    on the request path waits on the display or the metrics file.
+    """
+
+    def __init__(self, stats, progress_bar: bool = False, metrics_file: Optional[str] = None, metrics_interval: float = DEFAULT_METRICS_INTERVAL, hedger=None):
+        self.stats = stats
+        self.hedger = hedger
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.bar = None
+        self.progress_bar = progress_bar
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_metrics_write = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self) -> None:
+        """Open the progress bar and start the refresh thread, if either output is enabled."""
+        if not self.progress_bar and not self.metrics_file:
+            return
+        if self.progress_bar:
+            self.bar = tqdm(total=self.stats.total_bytes, unit='B', unit_scale=True, unit_divisor=1024, desc='cllm', file=sys.stderr, dynamic_ncols=True)
+        self._thread = threading.Thread(target=self._run, name='cllm-telemetry', daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stop the refresh thread and write the final progress and metrics."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._update()
+        if self.metrics_file:
+            self._write_metrics()
+        if self.bar is not None:
+            self.bar.close()
+
+    def _run(self) -> None:
+        interval = PROGRESS_REFRESH_SECONDS if self.bar is not None else self.metrics_interval
+        while not self._stop.wait(interval):
+            self._update()
+            if self.metrics_file and time.time() - self._last_metrics_write >= self.metrics_interval:
+                self._write_metrics()
+
+    def _escalations(self) -> int:
+        with self.stats.lock:
+            return sum(self.stats.escalations.values())
+
+    def _retries(self) -> int:
+        retries = self._escalations()
+        if self.hedger is not None:
+            retries += self.hedger.hedges
+        return retries
+
+    def _update(self) -> None:
+        if self.bar is None:
+            return
+        stats = self.stats
+        elapsed = max(time.time() - stats.start_time, 1e-9)
+        if self.bar.total is None and stats.total_bytes is not None:
+            self.bar.total = stats.total_bytes
+        self.bar.n = stats.bytes_done
+        self.bar.set_postfix_str(
+            f"items={stats.items_done} in_flight={stats.in_flight} "
+            f"tok/s={(stats.input_tokens + stats.output_tokens) / elapsed:.0f} "
+            f"err={stats.errors} retry={self._retries()}",
+            refresh=False,
+        )
+        self.bar.refresh()
+
+    def _write_metrics(self) -> None:
+        """Write all counters atomically, as the node exporter textfile collector requires."""
+        stats = self.stats
+        metrics = [
+            ('cllm_start_time_seconds', 'gauge', 'Unix time the run started.', [('', stats.start_time)]),
+            ('cllm_input_size_bytes', 'gauge', 'Total input size, if known up front.', [('', stats.total_bytes)] if stats.total_bytes is not None else []),
+            ('cllm_input_processed_bytes_total', 'counter', 'Input bytes whose output has been written.', [('', stats.bytes_done)]),
+            ('cllm_items_processed_total', 'counter', 'Input items (lines, chunks) whose output has been written.', [('', stats.items_done)]),
+            ('cllm_api_calls_total', 'counter', 'Completed API calls.', [('', stats.api_calls)]),
+            ('cllm_api_calls_in_flight', 'gauge', 'API calls currently in flight.', [('', stats.in_flight)]),
+            ('cllm_api_errors_total', 'counter', 'Failed API calls.', [('', stats.errors)]),
+            ('cllm_api_seconds_total', 'counter', 'Summed API call latency.', [('', stats.api_time)]),
+            ('cllm_tokens_total', 'counter', 'Tokens sent and received.', [('{direction="input"}', stats.input_tokens), ('{direction="output"}', stats.output_tokens)]),
+            ('cllm_escalations_total', 'counter', 'Items escalated to the next --cascade model.', [('', self._escalations())]),
+        ]
+        if self.hedger is not None:
+            metrics.append(('cllm_hedged_requests_total', 'counter', 'Requests duplicated by --hedge.', [('', self.hedger.hedges)]))
+        lines = []
+        for name, kind, help_text, samples in metrics:
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+
+        tmp_path = f"{self.metrics_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(tmp_path, self.metrics_file)
+        except OSError as e:
+            print(f"Warning: unable to write metrics file {self.metrics_file}: {e}", file=sys.stderr)
+        self._last_metrics_write = time.time()
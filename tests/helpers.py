@@ -0,0 +1,65 @@
+"""Shared fakes for the cllm test suites."""
+import threading
+import time
+from types import SimpleNamespace
+
+
+class WordEncoder:
+    """Tokenizer stand-in that counts space-separated words."""
+
+    def encode(self, text):
+        """Split text into words."""
+        return text.split(' ')
+
+    def decode(self, tokens):
+        """Join words back together."""
+        return ' '.join(tokens)
+
+
+class FakeClient:
+    """OpenAI client stand-in; answer(model, prompt) returns or raises.
+
+    Every call is recorded as (model, prompt, max_tokens). With usage set,
+    responses report word counts as billed tokens.
+    """
+
+    def __init__(self, answer=None, delay=0.0, usage=False):
+        """Set up call recording."""
+        self.answer = answer or (lambda model, prompt: f"echo {prompt}")
+        self.delay = delay
+        self.usage = usage
+        self.calls = []
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        """Answer one chat completion request."""
+        prompt = kwargs['messages'][-1]['content']
+        with self.lock:
+            self.calls.append((kwargs['model'], prompt,
+                               kwargs.get('max_tokens')))
+        if self.delay:
+            time.sleep(self.delay)
+        content = self.answer(kwargs['model'], prompt)
+        usage = None
+        if self.usage:
+            usage = SimpleNamespace(
+                prompt_tokens=len(prompt.split(' ')),
+                completion_tokens=len(content.split(' ')))
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def make_args(**overrides):
+    """Return the parsed-argument fields that runs and calls use."""
+    args = dict(
+        model='m', cascade=None, cascade_validate=None, system=None,
+        limit=None, temperature=None, verbose=False, budget=None,
+        max_inference_calls=None, send_empty=False, directory=None,
+        filter=None, context_length=40, tc=False, clipboard=False,
+        single_string_stdin=False, shard=None,
+    )
+    args.update(overrides)
+    return SimpleNamespace(**args)
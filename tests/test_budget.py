@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Test suite for the --budget-tokens/--budget-usd governor."""
+import threading
+import unittest
+
+from cllm.budget import Budget, BudgetExhausted
+from cllm.models import ModelPrice
+
+PRICES = {
+    'big': ModelPrice(10.0, 100.0),
+    'small': ModelPrice(1.0, 10.0),
+}
+
+
+def price_for(model):
+    """Return the fake price of a model."""
+    return PRICES[model]
+
+
+class TestBudget(unittest.TestCase):
+    """Test cases for reserving and settling calls against a budget."""
+
+    def test_stop_when_worst_case_does_not_fit(self):
+        """Test that a call whose input plus limit exceeds the rest stops."""
+        budget = Budget(max_tokens=1000, price_for=price_for)
+        reservation = budget.reserve('big', 100, 400)
+        self.assertEqual(reservation.tokens, 500)
+        budget.settle(reservation, 100, 400)
+        with self.assertRaises(BudgetExhausted):
+            budget.reserve('big', 200, 400)
+        self.assertTrue(budget.exhausted)
+        with self.assertRaises(BudgetExhausted):
+            budget.reserve('big', 1, 1)
+        self.assertEqual(budget.spent_tokens, 500)
+
+    def test_settle_frees_unused_reservation(self):
+        """Test that actual usage replaces the worst case."""
+        budget = Budget(max_tokens=1000, price_for=price_for)
+        budget.settle(budget.reserve('big', 100, 800), 100, 50)
+        self.assertEqual(budget.spent_tokens, 150)
+        self.assertEqual(budget.reserved_tokens, 0)
+        budget.reserve('big', 100, 700)
+
+    def test_waits_for_in_flight_calls(self):
+        """Test that a call that fits only after others settle waits."""
+        budget = Budget(max_tokens=1000, price_for=price_for)
+        first = budget.reserve('big', 100, 500)
+        reserved = threading.Event()
+
+        def second():
+            budget.reserve('big', 100, 500)
+            reserved.set()
+
+        thread = threading.Thread(target=second, daemon=True)
+        thread.start()
+        self.assertFalse(reserved.wait(0.2))
+        budget.settle(first, 100, 10)
+        self.assertTrue(reserved.wait(2))
+        thread.join(2)
+        self.assertFalse(budget.exhausted)
+
+    def test_waiting_call_stops_when_nothing_frees(self):
+        """Test that a waiting call stops once in-flight calls spend it all."""
+        budget = Budget(max_tokens=1000, price_for=price_for)
+        first = budget.reserve('big', 100, 500)
+        errors = []
+
+        def second():
+            try:
+                budget.reserve('big', 100, 500)
+            except BudgetExhausted as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=second, daemon=True)
+        thread.start()
+        budget.settle(first, 100, 500)
+        thread.join(2)
+        self.assertEqual(len(errors), 1)
+
+    def test_cheaper_model_switch(self):
+        """Test that cheaper-model switches for the rest of the run."""
+        budget = Budget(max_usd=0.01, policy='cheaper-model',
+                        fallback_model='small', price_for=price_for)
+        # big: 100 * 10 + 100 * 100 = 11000 micro-dollars > 10000
+        reservation = budget.reserve('big', 100, 100)
+        self.assertEqual(reservation.model, 'small')
+        self.assertAlmostEqual(reservation.usd, 0.0011)
+        budget.settle(reservation, 100, 100)
+        self.assertAlmostEqual(budget.spent_usd, 0.0011)
+        self.assertEqual(budget.reserve('big', 1, 1).model, 'small')
+
+    def test_lower_limit_down_to_min_limit(self):
+        """Test that lower-limit shrinks the limit, then stops."""
+        budget = Budget(max_tokens=1000, policy='lower-limit',
+                        min_limit=64, price_for=price_for)
+        budget.settle(budget.reserve('big', 100, 600), 100, 600)
+        reservation = budget.reserve('big', 100, 600)
+        self.assertEqual(reservation.limit, 200)
+        budget.settle(reservation, 100, 180)
+        with self.assertRaises(BudgetExhausted):
+            budget.reserve('big', 10, 600)
+        self.assertIn('74 tokens', budget.exhausted)
+
+    def test_lower_limit_by_cost(self):
+        """Test that lower-limit derives the limit from the USD left."""
+        budget = Budget(max_usd=0.01, policy='lower-limit',
+                        min_limit=1, price_for=price_for)
+        # 10000 - 100 * 10 micro-dollars of input leaves 90 output tokens
+        self.assertEqual(budget.reserve('big', 100, 1000).limit, 90)
+
+    def test_release_on_failure(self):
+        """Test that a failed call frees its reservation without spend."""
+        budget = Budget(max_tokens=1000, price_for=price_for)
+        reservation = budget.reserve('big', 100, 800)
+        budget.release(reservation)
+        self.assertEqual(budget.reserved_tokens, 0)
+        self.assertEqual(budget.spent_tokens, 0)
+        self.assertEqual(budget.in_flight, 0)
+        budget.reserve('big', 100, 800)
+
+
+if __name__ == '__main__':
+    unittest.main()
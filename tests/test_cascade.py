@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Test suite for --cascade escalation."""
+import contextlib
+import io
+import unittest
+
+from cllm.budget import Budget
+from cllm.main import CallLimitReached, Stats, call_llm, escalation_reason
+from cllm.models import ModelPrice
+from helpers import FakeClient, WordEncoder, make_args
+
+
+class TestEscalationReason(unittest.TestCase):
+    """Test cases for deciding whether an answer escalates."""
+
+    def test_empty(self):
+        """Test that blank and missing answers escalate."""
+        self.assertEqual(escalation_reason("  \n", 1, None, None), 'empty')
+        self.assertEqual(escalation_reason(None, 0, None, None), 'empty')
+
+    def test_false(self):
+        """Test that a 'False (reason)' answer escalates."""
+        self.assertEqual(escalation_reason("False (no date found)", 4, None, None), 'false')
+        self.assertIsNone(escalation_reason("False positives are rare", 4, None, None))
+
+    def test_validation(self):
+        """Test that an answer must match --cascade-validate."""
+        self.assertEqual(escalation_reason("maybe", 1, None, r'^\d+$'), 'validation')
+        self.assertIsNone(escalation_reason("42", 1, None, r'^\d+$'))
+
+    def test_length(self):
+        """Test that an answer using the whole limit escalates as truncated."""
+        self.assertEqual(escalation_reason("a b c", 3, 3, None), 'length')
+        self.assertEqual(escalation_reason("a b c d", 4, 3, None), 'length')
+        self.assertIsNone(escalation_reason("a b", 2, 3, None))
+
+
+class TestCascade(unittest.TestCase):
+    """Test cases for the cascade loop in call_llm."""
+
+    def run_cascade(self, answer, **overrides):
+        """Call call_llm with a fake client; return the response, client and stats."""
+        args = make_args(cascade=['small', 'mid', 'big'], **overrides)
+        client = FakeClient(answer, usage=True)
+        stats = Stats()
+        with contextlib.redirect_stderr(io.StringIO()):
+            response = call_llm(client, args, "prompt", WordEncoder(), stats)
+        return response, client, stats
+
+    def models(self, client):
+        """Return the models a fake client was called with."""
+        return [model for model, _, _ in client.calls]
+
+    def test_first_acceptable_answer_wins(self):
+        """Test that a good answer from the first model stops the cascade."""
+        response, client, stats = self.run_cascade(lambda model, prompt: "fine")
+        self.assertEqual(response, "fine")
+        self.assertEqual(self.models(client), ['small'])
+        self.assertEqual(stats.cascade_answers[0], 1)
+
+    def test_escalates_until_acceptable(self):
+        """Test that empty and 'False (...)' answers move to the next model."""
+        answers = {'small': "", 'mid': "False (unsure)", 'big': "done"}
+        response, client, stats = self.run_cascade(lambda model, prompt: answers[model])
+        self.assertEqual(response, "done")
+        self.assertEqual(self.models(client), ['small', 'mid', 'big'])
+        self.assertEqual(stats.escalations[(0, 'empty')], 1)
+        self.assertEqual(stats.escalations[(1, 'false')], 1)
+        self.assertEqual(stats.cascade_answers[2], 1)
+
+    def test_final_answer_is_kept(self):
+        """Test that the last model's answer is returned even if it would escalate."""
+        response, client, _ = self.run_cascade(lambda model, prompt: "False (no)")
+        self.assertEqual(response, "False (no)")
+        self.assertEqual(len(client.calls), 3)
+
+    def test_validation_and_length(self):
+        """Test escalation on a failed --cascade-validate and on a truncated answer."""
+        answers = {'small': "no digits", 'mid': "1 2 3", 'big': "7"}
+        response, _, stats = self.run_cascade(lambda model, prompt: answers[model],
+                                              cascade_validate=r'\d', limit=3)
+        self.assertEqual(response, "7")
+        self.assertEqual(stats.escalations[(0, 'validation')], 1)
+        self.assertEqual(stats.escalations[(1, 'length')], 1)
+
+    def test_error_on_non_final_level_escalates(self):
+        """Test that an API error escalates, except at the last level."""
+        def answer(model, prompt):
+            if model == 'small':
+                raise RuntimeError("overloaded")
+            return "ok"
+
+        response, client, stats = self.run_cascade(answer)
+        self.assertEqual(response, "ok")
+        self.assertEqual(stats.escalations[(0, 'error')], 1)
+        self.assertEqual(stats.errors, 1)
+
+        def failing(model, prompt):
+            raise RuntimeError("down")
+
+        with self.assertRaises(RuntimeError):
+            self.run_cascade(failing)
+
+    def test_budget_switch_forces_final(self):
+        """Test that after a switch to the cheaper model its answer is not escalated."""
+        prices = {'small': ModelPrice(1.0, 10.0), 'mid': ModelPrice(10.0, 100.0), 'big': ModelPrice(10.0, 100.0)}
+        budget = Budget(max_usd=0.005, policy='cheaper-model', fallback_model='small', price_for=prices.get)
+        response, client, stats = self.run_cascade(lambda model, prompt: "False (no)", budget=budget, limit=100)
+        self.assertEqual(response, "False (no)")
+        self.assertEqual(self.models(client), ['small', 'small'])
+        self.assertTrue(budget.switched)
+
+    def test_call_limit_during_escalation(self):
+        """Test that -n counts escalation calls and stops the cascade."""
+        args = make_args(cascade=['small', 'mid', 'big'], max_inference_calls=2)
+        client = FakeClient(lambda model, prompt: "")
+        with self.assertRaises(CallLimitReached):
+            call_llm(client, args, "prompt", WordEncoder(), Stats())
+        self.assertEqual(self.models(client), ['small', 'mid'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Test suite for splitting files into context-sized chunks."""
+import os
+import tempfile
+import unittest
+
+from cllm.main import Stats, iter_work_items, process_files
+from helpers import WordEncoder, make_args
+
+
+class CountingEncoder(WordEncoder):
+    """A WordEncoder that counts the characters it encodes."""
+
+    def __init__(self):
+        self.encoded_chars = 0
+
+    def encode(self, text):
+        self.encoded_chars += len(text)
+        return super().encode(text)
+
+
+class TestProcessFiles(unittest.TestCase):
+    """Test cases for process_files."""
+
+    def setUp(self):
+        """Write a file of 2000 four-word lines."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "big.txt")
+        with open(self.path, 'w') as f:
+            for i in range(2000):
+                f.write(f"line {i} of text\n")
+        self.size = os.path.getsize(self.path)
+
+    def chunks(self, encoder, context_length):
+        """Return the chunks process_files yields for the test file."""
+        return list(process_files(self.tmp.name, context_length, None, None, False, False, encoder, {},
+                                  files_and_sizes=[(self.path, self.size)]))
+
+    def test_one_chunk_encodes_linearly(self):
+        """Test that a file under the limit is encoded block by block, not re-encoded per block."""
+        encoder = CountingEncoder()
+        (_, start_line, chunk), = self.chunks(encoder, 100000)
+        self.assertEqual(start_line, 1)
+        self.assertEqual(chunk.split("\n")[-2], "line 1999 of text")
+        self.assertLess(encoder.encoded_chars, 2 * self.size)
+
+    def test_split_chunks_fit(self):
+        """Test that split chunks fit the limit and keep line numbers."""
+        chunks = self.chunks(WordEncoder(), 500)
+        self.assertGreater(len(chunks), 1)
+        for _, start_line, chunk in chunks:
+            self.assertLessEqual(len(WordEncoder().encode(chunk)), 500)
+            first = chunk.split("\n")[0].split()
+            if first[0] == "line":
+                self.assertEqual(int(first[1]), start_line - 1)
+
+
+class TestChunkSizes(unittest.TestCase):
+    """Test cases for the input bytes each -d chunk covers."""
+
+    def test_sizes_add_up_to_total(self):
+        """Test that chunk sizes sum to the files' bytes, so progress reaches its total."""
+        with tempfile.TemporaryDirectory() as root:
+            files = {
+                "a.txt": "   \n\n",
+                "b.txt": "  padded   words  \n" * 50,
+                "c.txt": "\n",
+                "d.txt": "short\n\n\n",
+                "e.txt": "",
+            }
+            for name, text in files.items():
+                with open(os.path.join(root, name), 'w') as f:
+                    f.write(text)
+            stats = Stats()
+            args = make_args(directory=root, context_length=30)
+            items = list(iter_work_items(args, WordEncoder(), ['.txt'], stats))
+        self.assertGreater(len(items), 2)
+        self.assertEqual(stats.total_bytes, sum(len(text) for text in files.values()))
+        self.assertEqual(sum(item.size for item in items), stats.total_bytes)
+        self.assertTrue(all(item.size > 0 for item in items))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Test suite for the -gcm diff splitting."""
+import unittest
+
+from cllm.main import split_diff_by_file, split_file_diff, unquote_git_path
+from helpers import WordEncoder
+
+MODIFIED = (
+    "diff --git a/src/app.py b/src/app.py\n"
+    "index 1111111..2222222 100644\n"
+    "--- a/src/app.py\n"
+    "+++ b/src/app.py\n"
+    "@@ -1,2 +1,2 @@\n"
+    "-old\n"
+    "++ added line that looks like a header\n"
+)
+RENAME = (
+    "diff --git a/old name.txt b/new name.txt\n"
+    "similarity index 100%\n"
+    "rename from old name.txt\n"
+    "rename to new name.txt\n"
+)
+MODE = (
+    "diff --git a/run.sh b/run.sh\n"
+    "old mode 100644\n"
+    "new mode 100755\n"
+)
+BINARY = (
+    "diff --git a/img.png b/img.png\n"
+    "index 3333333..4444444 100644\n"
+    "Binary files a/img.png and b/img.png differ\n"
+)
+SPACES = (
+    "diff --git a/my file.txt b/my file.txt\n"
+    "index 5555555..6666666 100644\n"
+    "--- a/my file.txt\t\n"
+    "+++ b/my file.txt\t\n"
+    "@@ -1 +1 @@\n"
+    "-a\n"
+    "+b\n"
+)
+QUOTED = (
+    'diff --git "a/caf\\303\\251 \\"x\\".txt" "b/caf\\303\\251 \\"x\\".txt"\n'
+    "index 7777777..8888888 100644\n"
+    '--- "a/caf\\303\\251 \\"x\\".txt"\n'
+    '+++ "b/caf\\303\\251 \\"x\\".txt"\n'
+    "@@ -1 +1 @@\n"
+    "-a\n"
+    "+b\n"
+)
+QUOTED_BINARY = (
+    'diff --git "a/caf\\303\\251.png" "b/caf\\303\\251.png"\n'
+    "index 9999999..aaaaaaa 100644\n"
+    'Binary files "a/caf\\303\\251.png" and "b/caf\\303\\251.png" differ\n'
+)
+DELETED = (
+    "diff --git a/gone.txt b/gone.txt\n"
+    "deleted file mode 100644\n"
+    "index bbbbbbb..0000000\n"
+    "--- a/gone.txt\n"
+    "+++ /dev/null\n"
+    "@@ -1 +0,0 @@\n"
+    "-bye\n"
+)
+
+
+class TestSplitDiffByFile(unittest.TestCase):
+    """Test cases for splitting a staged diff into files."""
+
+    def paths(self, diff):
+        """Return the paths split_diff_by_file finds."""
+        return [path for path, _, _ in split_diff_by_file(diff)]
+
+    def test_paths(self):
+        """Test each kind of file header."""
+        diff = (MODIFIED + RENAME + MODE + BINARY + SPACES + QUOTED
+                + QUOTED_BINARY + DELETED)
+        self.assertEqual(self.paths(diff), [
+            "src/app.py", "new name.txt", "run.sh", "img.png",
+            "my file.txt", 'café "x".txt', "café.png", "gone.txt",
+        ])
+
+    def test_blob_keys(self):
+        """Test that blob keys use index hashes, else the block's hash."""
+        (_, block, key), = split_diff_by_file(MODIFIED)
+        self.assertEqual(block, MODIFIED)
+        self.assertEqual(key, "src/app.py:1111111..2222222")
+        (_, _, rename_key), = split_diff_by_file(RENAME)
+        (_, _, mode_key), = split_diff_by_file(MODE)
+        self.assertTrue(rename_key.startswith("new name.txt:"))
+        self.assertNotEqual(rename_key.split(':')[1], mode_key.split(':')[1])
+
+    def test_unquote(self):
+        """Test git's C-style path quoting."""
+        self.assertEqual(unquote_git_path('"a\\tb\\\\c"'), "a\tb\\c")
+        self.assertEqual(unquote_git_path("plain name"), "plain name")
+
+
+class TestSplitFileDiff(unittest.TestCase):
+    """Test cases for splitting one file's diff to fit a budget."""
+
+    HEADER = (
+        "diff --git a/f.txt b/f.txt\n"
+        "index 1111111..2222222 100644\n"
+        "--- a/f.txt\n"
+        "+++ b/f.txt\n"
+    )
+
+    def setUp(self):
+        """Set up the word-counting encoder."""
+        self.encoder = WordEncoder()
+
+    def tokens(self, text):
+        """Count tokens as the splitter does."""
+        return len(self.encoder.encode(text))
+
+    def test_header_on_every_part(self):
+        """Test that hunks are packed into parts that each repeat the header."""
+        hunks = ''.join(f"@@ -{i} +{i} @@\n-old {i}\n+new {i}\n"
+                        for i in range(1, 21))
+        parts = split_file_diff(self.HEADER + hunks, 40, self.encoder)
+        self.assertGreater(len(parts), 1)
+        for part in parts:
+            self.assertTrue(part.startswith(self.HEADER))
+            self.assertLessEqual(self.tokens(part), 40 + 1)
+        bodies = ''.join(part[len(self.HEADER):] for part in parts)
+        self.assertEqual(bodies, hunks)
+
+    def test_oversized_hunk_packs_lines(self):
+        """Test that a hunk over the budget is split between lines."""
+        hunk = "@@ -1,30 +1,30 @@\n" + ''.join(
+            f"+line {i} with some words\n" for i in range(30))
+        parts = split_file_diff(self.HEADER + hunk, 40, self.encoder)
+        self.assertGreater(len(parts), 1)
+        for part in parts:
+            body = part[len(self.HEADER):]
+            self.assertTrue(body.endswith("\n"))
+            self.assertLessEqual(self.tokens(part), 40 + 1)
+        self.assertEqual(''.join(part[len(self.HEADER):] for part in parts),
+                         hunk)
+
+    def test_no_hunks(self):
+        """Test that a binary diff is returned whole, without a repeated header."""
+        self.assertEqual(split_file_diff(BINARY, 100, self.encoder), [BINARY])
+
+
+if __name__ == '__main__':
+    unittest.main()
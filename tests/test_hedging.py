@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Test suite for hedged requests."""
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from cllm.hedging import Hedger
+
+
+def response(text, prompt_tokens=10, completion_tokens=3):
+    """Return a chat completion stand-in with usage."""
+    usage = SimpleNamespace(
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    return SimpleNamespace(text=text, usage=usage)
+
+
+class TestHedger(unittest.TestCase):
+    """Test cases for Hedger.run and its waste accounting."""
+
+    def setUp(self):
+        """Set up a hedger that hedges every request after 10 ms."""
+        self.hedger = Hedger(max_rate=1.0, initial_delay=0.01)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def slow(self):
+        """Answer only once the test releases it."""
+        self.release.wait(5)
+        return response("slow")
+
+    def fast(self):
+        """Answer immediately."""
+        return response("fast")
+
+    def test_fast_primary_not_hedged(self):
+        """Test that a primary answering in time is not duplicated."""
+        result = self.hedger.run(self.fast, self.slow)
+        self.assertEqual(result.text, "fast")
+        self.assertEqual(self.hedger.hedges, 0)
+
+    def test_abandoned_prompt_counted_while_in_flight(self):
+        """Test that a losing attempt's prompt is waste before it ends."""
+        for _ in range(3):
+            self.assertEqual(self.hedger.run(self.slow, self.fast).text,
+                             "fast")
+        self.assertEqual(self.hedger.hedges, 3)
+        self.assertEqual(self.hedger.backup_wins, 3)
+        self.assertEqual(self.hedger.abandoned_in_flight, 3)
+        self.assertEqual(self.hedger.wasted_input_tokens, 30)
+        self.assertEqual(self.hedger.wasted_output_tokens, 0)
+
+    def test_late_loser_adds_output(self):
+        """Test that a loser finishing later adds only its output tokens."""
+        self.hedger.run(self.slow, self.fast)
+        self.release.set()
+        for _ in range(500):
+            with self.hedger.lock:
+                if not self.hedger.abandoned_in_flight:
+                    break
+            time.sleep(0.01)
+        self.assertEqual(self.hedger.abandoned_in_flight, 0)
+        self.assertEqual(self.hedger.wasted_input_tokens, 10)
+        self.assertEqual(self.hedger.wasted_output_tokens, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Test suite for --pipeline runs."""
+import io
+import unittest
+from unittest import mock
+
+from cllm.main import Stats, WorkItem, run_pipeline
+from cllm.pipeline import Stage
+from cllm.prompts import compile_prompt
+from helpers import FakeClient, WordEncoder, make_args
+
+
+class TestRunPipeline(unittest.TestCase):
+    """Test cases for run_pipeline."""
+
+    def run_pipeline(self, client, args, count):
+        """Run a two-stage pipeline over count items; return output lines."""
+        stages = [Stage("a {context}"), Stage("b {context}")]
+        templates = [compile_prompt(stage.prompt) for stage in stages]
+        items = (WorkItem(i, str(i)) for i in range(count))
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+            run_pipeline(client, args, stages, templates, items,
+                         WordEncoder(), Stats())
+        return out.getvalue().splitlines()
+
+    def test_max_inference_calls_is_hard_cap(self):
+        """Test that -n caps API calls with many items in flight."""
+        client = FakeClient(lambda model, prompt: "one\ntwo", delay=0.05)
+        self.run_pipeline(client, make_args(max_inference_calls=2), 100)
+        self.assertEqual(len(client.calls), 2)
+
+    def test_output_in_input_order(self):
+        """Test that every final line is written without -n."""
+        client = FakeClient(lambda model, prompt: "one\ntwo")
+        lines = self.run_pipeline(client, make_args(), 5)
+        self.assertEqual(len(lines), 5 * 2 * 2)
+        self.assertEqual(len(client.calls), 5 * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
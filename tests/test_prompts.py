@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Test suite for compiled prompts and the prompt library."""
+import os
+import tempfile
+import unittest
+
+from cllm.main import expand_prompts
+from cllm.prompts import PromptLibrary, compile_prompt, escape_unknown_placeholders
+from helpers import FakeClient, make_args
+
+
+class TestCompiledPrompt(unittest.TestCase):
+    """Test cases for compiling and rendering templates."""
+
+    def test_json_braces_survive_escaping(self):
+        """Test that JSON in an LLM-written prompt renders literally."""
+        text = 'Reply as {"tags": [{"name": "x"}]} about {context}'
+        escaped = escape_unknown_placeholders(text)
+        self.assertEqual(escaped, 'Reply as {{"tags": [{{"name": "x"}}]}} about {context}')
+        prompt = compile_prompt(text, escape_unknown=True)
+        self.assertEqual(prompt.render("cats"), 'Reply as {"tags": [{"name": "x"}]} about cats')
+
+    def test_escaping_keeps_placeholders(self):
+        """Test that known placeholders and escaped braces are left alone."""
+        text = "{filename}:{startline} {{literal}} {context!r:>12}"
+        self.assertEqual(escape_unknown_placeholders(text), text)
+
+    def test_conversion_and_format_spec(self):
+        """Test that {context!r} and {context:>10} render like str.format."""
+        for template in ("{context!r}", "{context:>10}", "[{context!s:^9}] {filename}@{startline:04d}"):
+            prompt = compile_prompt(template)
+            self.assertEqual(prompt.render("abc", "f.py", 7),
+                             template.format(context="abc", filename="f.py", startline=7))
+
+    def test_unknown_fields_raise(self):
+        """Test that unknown, positional and malformed placeholders are rejected."""
+        for template in ("{foo}", "{}", "{0}", "{context.upper}", "{context"):
+            with self.assertRaises(ValueError):
+                compile_prompt(template)
+
+    def test_context_suffix(self):
+        """Test that a template without {context} gets context appended only when there is some."""
+        prompt = compile_prompt("Summarize")
+        self.assertEqual(prompt.render(""), "Summarize")
+        self.assertEqual(prompt.render("  "), "Summarize")
+        self.assertEqual(prompt.render("text"), "Summarize | Context: text")
+        self.assertEqual(compile_prompt("Say {context}").render(""), "Say ")
+
+
+class TestPromptLibrary(unittest.TestCase):
+    """Test cases for named, versioned templates."""
+
+    def setUp(self):
+        """Set up a library in a temporary file."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "prompts.json")
+
+    def test_versions(self):
+        """Test that add bumps versions and get finds each one."""
+        library = PromptLibrary(self.path)
+        first = library.add("tidy", "one {context}", "tidy", "k1", "m")
+        self.assertIs(library.add("tidy", "one {context}", "tidy", "k1", "m"), first)
+        second = library.add("tidy", "two {context}", "tidy", "k2", "m")
+        self.assertEqual((first.version, second.version), (1, 2))
+        self.assertEqual(library.get("tidy@1"), first)
+        self.assertEqual(library.get("tidy@2"), second)
+        self.assertEqual(library.get("tidy"), second)
+        with self.assertRaises(KeyError):
+            library.get("tidy@3")
+        with self.assertRaises(KeyError):
+            library.get("other")
+
+    def test_save_and_reload(self):
+        """Test that saved templates are found by key after a reload."""
+        library = PromptLibrary(self.path)
+        entry = library.add("tidy", "one {context}", "tidy", "k1", "m")
+        library.save()
+        reloaded = PromptLibrary(self.path)
+        self.assertEqual(reloaded.find("k1"), entry)
+        self.assertIsNone(reloaded.find("k2"))
+
+    def test_save_template_on_cached_expansion(self):
+        """Test that --save-template names a cached expansion instead of being ignored."""
+        client = FakeClient(lambda model, prompt: "Expanded: {context}")
+        args = make_args(prompt=["tidy up"], expand_prompt=None, recompile=False, save_template=None)
+        expand_prompts(client, args, PromptLibrary(self.path))
+        args.save_template = "tidy"
+        library = PromptLibrary(self.path)
+        self.assertEqual(expand_prompts(client, args, library), ["Expanded: {context}"])
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(PromptLibrary(self.path).get("tidy").template, "Expanded: {context}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Test suite for running several prompts over each item."""
+import contextlib
+import io
+import time
+import unittest
+from unittest import mock
+
+from cllm.budget import BudgetExhausted
+from cllm.main import OutputWriter, Stats, WorkItem, run_prompts
+from cllm.prompts import compile_prompt
+from helpers import FakeClient, WordEncoder, make_args
+
+
+class TestRunPrompts(unittest.TestCase):
+    """Test cases for run_prompts."""
+
+    PROMPTS = ["a {context}", "b {context}", "c {context}"]
+
+    def run_prompts(self, client, args, count=1):
+        """Run the prompts over count items; return the JSONL output and any error."""
+        templates = [compile_prompt(prompt) for prompt in self.PROMPTS]
+        items = (WorkItem(i, str(i)) for i in range(count))
+        error = None
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as out, \
+                contextlib.redirect_stderr(io.StringIO()):
+            try:
+                run_prompts(client, args, templates, items, WordEncoder(), Stats(),
+                            OutputWriter(len(templates), jsonl=True))
+            except Exception as e:
+                error = e
+        return out.getvalue(), error
+
+    def test_budget_stop_keeps_other_prompts(self):
+        """Test that the item's completed prompts are written before the budget error."""
+        def answer(model, prompt):
+            if prompt.startswith("b"):
+                raise BudgetExhausted("spent")
+            time.sleep(0.05)
+            return prompt.upper()
+
+        output, error = self.run_prompts(FakeClient(answer), make_args(), count=3)
+        self.assertIsInstance(error, BudgetExhausted)
+        self.assertIn('"prompt": 1, "index": 0, "response": "A 0"', output)
+        self.assertIn('"prompt": 3, "index": 0, "response": "C 0"', output)
+        self.assertNotIn('"index": 1', output)
+
+    def test_call_limit_keeps_other_prompts(self):
+        """Test that a cascade escalation hitting -n still writes the other prompts."""
+        def answer(model, prompt):
+            if prompt.startswith("a"):
+                time.sleep(0.1)
+                return ""  # escalates after the other prompts have claimed their calls
+            return prompt.upper()
+
+        args = make_args(cascade=['small', 'big'], max_inference_calls=3)
+        output, error = self.run_prompts(FakeClient(answer), args)
+        self.assertIsNone(error)
+        self.assertNotIn('"prompt": 1', output)
+        self.assertIn('"prompt": 2, "index": 0, "response": "B 0"', output)
+        self.assertIn('"prompt": 3, "index": 0, "response": "C 0"', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
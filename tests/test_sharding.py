@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Test suite for --shard and cllm merge."""
+import io
+import json
+import random
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from cllm.main import (
+    OutputWriter, Stats, iter_work_items, merge_main, run_prompts,
+)
+from cllm.prompts import compile_prompt
+from cllm.sharding import (
+    ShardSpec, ShardWriter, assign_files, parse_shard_spec,
+    read_shard_outputs,
+)
+from helpers import FakeClient, WordEncoder, make_args
+
+
+class TestAssignFiles(unittest.TestCase):
+    """Test cases for assigning files to shards."""
+
+    def setUp(self):
+        """Set up a tree of files with random sizes."""
+        rng = random.Random(7)
+        self.files = [(f"/data/dir{i % 5}/f{i}.txt", rng.randint(0, 10000))
+                      for i in range(200)]
+
+    def test_deterministic(self):
+        """Test that every worker computes the same assignment."""
+        by_path = dict(zip([path for path, _ in self.files],
+                           assign_files(self.files, "/data", 4)))
+        shuffled = list(self.files)
+        random.Random(1).shuffle(shuffled)
+        again = dict(zip([path for path, _ in shuffled],
+                         assign_files(shuffled, "/data", 4)))
+        self.assertEqual(by_path, again)
+
+    def test_relative_to_directory(self):
+        """Test that the mount point of the tree does not matter."""
+        moved = [(path.replace("/data", "/mnt/other"), size)
+                 for path, size in self.files]
+        self.assertEqual(assign_files(self.files, "/data", 3),
+                         assign_files(moved, "/mnt/other", 3))
+
+    def test_balanced_by_bytes(self):
+        """Test that shard loads differ by at most one file."""
+        assignment = assign_files(self.files, "/data", 4)
+        loads = [0] * 4
+        for (_, size), shard in zip(self.files, assignment):
+            loads[shard - 1] += size
+        largest = max(size for _, size in self.files)
+        self.assertLessEqual(max(loads) - min(loads), largest)
+
+    def test_parse_shard_spec(self):
+        """Test that i/N is parsed and validated."""
+        self.assertEqual(parse_shard_spec("2/8"), ShardSpec(2, 8))
+        for spec in ("0/3", "4/3", "1", "a/b"):
+            with self.assertRaises(ValueError):
+                parse_shard_spec(spec)
+
+
+class TestReadShardOutputs(unittest.TestCase):
+    """Test cases for reading shard outputs back."""
+
+    def setUp(self):
+        """Set up a temporary directory for shard files."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_shard(self, name, index, count, positions, prompts=1):
+        """Write a shard output holding records at positions."""
+        out = io.StringIO()
+        writer = ShardWriter(ShardSpec(index, count), prompts, out=out)
+        for position in positions:
+            item = SimpleNamespace(position=position, filename=None)
+            writer.write(item, 0, f"r{position}")
+        path = Path(self.tmp.name) / name
+        path.write_text(out.getvalue())
+        return str(path)
+
+    def test_records_in_position_order(self):
+        """Test that records from all shards come back in input order."""
+        first = self.write_shard("a", 1, 2, [(0,), (3,), (4,)])
+        second = self.write_shard("b", 2, 2, [(1,), (2,), (5,)])
+        _, records = read_shard_outputs([second, first])
+        self.assertEqual([record['pos'] for record in records],
+                         [[i] for i in range(6)])
+
+    def test_mismatched_job(self):
+        """Test that shards of differently split jobs are rejected."""
+        first = self.write_shard("a", 1, 2, [(0,)])
+        other = self.write_shard("b", 2, 3, [(1,)])
+        with self.assertRaises(ValueError):
+            read_shard_outputs([first, other])
+
+    def test_duplicate_shard(self):
+        """Test that the same shard given twice is rejected."""
+        first = self.write_shard("a", 1, 2, [(0,)])
+        again = self.write_shard("b", 1, 2, [(0,)])
+        with self.assertRaises(ValueError):
+            read_shard_outputs([first, again])
+
+    def test_missing_shard_warns(self):
+        """Test that an incomplete set of shards is reported."""
+        first = self.write_shard("a", 1, 2, [(0,)])
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as err:
+            read_shard_outputs([first])
+        self.assertIn("missing shard(s) 2", err.getvalue())
+
+
+class TestShardMergeRoundTrip(unittest.TestCase):
+    """Test that merged shard outputs equal a single-node run."""
+
+    PROMPTS = ["a {filename}:{startline} {context}", "b {context}"]
+
+    def setUp(self):
+        """Set up a temporary directory for inputs and outputs."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+
+    def run_once(self, args, writer, stdin_text):
+        """Run the prompts over the input, writing through writer."""
+        templates = [compile_prompt(prompt) for prompt in self.PROMPTS]
+        with mock.patch("sys.stdin", io.StringIO(stdin_text)):
+            items = iter_work_items(args, WordEncoder(), ['.txt'], Stats())
+            run_prompts(FakeClient(), args, templates, items,
+                        WordEncoder(), Stats(), writer)
+
+    def round_trip(self, shard_count, stdin_text='', **overrides):
+        """Return (single-node output, merged output of shard_count shards)."""
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+            writer = OutputWriter(len(self.PROMPTS), jsonl=True)
+            self.run_once(make_args(**overrides), writer, stdin_text)
+        single = out.getvalue()
+
+        paths = []
+        for index in range(1, shard_count + 1):
+            shard = ShardSpec(index, shard_count)
+            buffer = io.StringIO()
+            writer = ShardWriter(shard, len(self.PROMPTS), out=buffer)
+            self.run_once(make_args(shard=shard, **overrides), writer,
+                          stdin_text)
+            path = self.root / f"shard{index}.jsonl"
+            path.write_text(buffer.getvalue())
+            paths.append(str(path))
+
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+            merge_main(list(reversed(paths)) + ['--jsonl'])
+        return single, out.getvalue()
+
+    def test_directory(self):
+        """Test the round trip for -d, with files split into chunks."""
+        tree = self.root / "tree"
+        for i in range(9):
+            path = tree / f"d{i % 3}" / f"f{i}.txt"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(''.join(f"file {i} line {n} " * (i + 1) + "\n"
+                                    for n in range(12)))
+        single, merged = self.round_trip(3, directory=str(tree))
+        self.assertGreater(len(single.splitlines()), 2 * 9)
+        self.assertEqual(single, merged)
+
+    def test_stdin_lines(self):
+        """Test the round trip for stdin lines, including empty ones."""
+        text = ''.join(f"line {n}\n" if n % 5 else "\n" for n in range(40))
+        single, merged = self.round_trip(4, stdin_text=text)
+        self.assertEqual(len(single.splitlines()), 2 * 40)
+        self.assertEqual(single, merged)
+        self.assertEqual(
+            [json.loads(line)['index'] for line in merged.splitlines()],
+            [n for n in range(40) for _ in range(2)])
+
+
+if __name__ == '__main__':
+    unittest.main()